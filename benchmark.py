@@ -0,0 +1,448 @@
+"""性能测试：在无界面（offscreen）模式下测量课件列表的加载、布局、切换分类和滚动
+
+用法: python benchmark.py [--sizes=100,1000,5000,20000] [--downloads=4] [--file-size=<字节数>]
+                         [--timeout=<秒>] [--output=<结果.json>] [--compare=<旧结果.json>]
+
+每个目录规模单独启动一个替身服务器（stub_server.py --synthetic）和一个测试子进程，
+子进程使用临时下载目录，不会读写真实的下载记录，也不会打开下载的文件。
+测量项目（时间单位为毫秒）:
+  catalog                         解析课件目录的耗时、每个课件占用的内存（原始JSON和Material）和按科目筛选的耗时
+  first_card_ms / first_paint_ms  从创建主窗口到第一张卡片创建 / 第一次绘制（包含获取目录）
+  full_layout_ms                  到卡片布局的防抖定时器和移动动画全部结束
+  category_switch_ms              切换分类时load_materials本身的耗时，settled为到布局稳定为止
+  memory_per_card_bytes           主窗口占用的进程内存平均到每张卡片（需要psutil或Linux的/proc）
+  scroll / downloads              滚动列表和同时下载时界面定时器晚到的时间（事件循环卡顿）
+结果以JSON输出到--output指定的文件（默认输出到屏幕），--compare 时与旧结果逐项对比。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STUB_SERVER = os.path.join(ROOT, "stub_server.py")
+
+DEFAULT_SIZES = [100, 1000, 5000, 20000]
+DEFAULT_DOWNLOADS = 4
+DEFAULT_FILE_SIZE = 8 * 1024 * 1024
+CHILD_TIMEOUT = 1800  # 单个目录规模的默认最长测试时间（秒），超时的规模在结果中记为error
+
+SETTLE_QUIET = 0.15  # 布局连续空闲这么久（秒）才算稳定，需大于FlowLayout的80毫秒防抖
+SETTLE_TIMEOUT = 600
+STALL_INTERVAL = 0.01  # 检测卡顿的定时器间隔（秒）
+SCROLL_FRAMES = 300  # 滚动测试的帧数，每帧16毫秒，滚动三分之一屏
+CATEGORY_SWITCHES = 5
+DOWNLOAD_TIMEOUT = 300
+
+
+def parse_options(argv):
+    return dict(arg[2:].partition("=")[::2] for arg in argv if arg.startswith("--"))
+
+
+def memory_usage():
+    """当前进程占用的物理内存（字节），无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 2)
+
+
+def summarize(samples):
+    """把一组耗时（秒）汇总为毫秒统计"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "median": milliseconds(statistics.median(ordered)),
+        "p95": milliseconds(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+        "max": milliseconds(ordered[-1]),
+    }
+
+
+# ---------------- 测试子进程 ----------------
+
+def isolate_client(workdir, server_url):
+    """导入main.py，让客户端使用临时下载目录和替身服务器，返回main模块
+
+    下载目录在导入main.py时就会创建，所以必须在导入之前通过环境变量指定。
+    """
+    if "main" in sys.modules:
+        raise RuntimeError("main.py已经导入，无法再更换下载目录")
+    os.environ["NEXTPPT_DOWNLOAD_DIR"] = workdir
+    import main
+    main.mirror_pool = main.MirrorPool([server_url])
+
+    # 测试中下载完成后不打开文件
+    class DesktopServices:
+        @staticmethod
+        def openUrl(url):
+            return True
+    main.QDesktopServices = DesktopServices
+    return main
+
+
+def measure_catalog(main, server_url):
+    """测量目录模型：解析耗时、每个课件占用的Python内存和按科目筛选的耗时"""
+    text = requests.get(f"{server_url}/api/materials", timeout=60).text
+
+    def build(data):
+        catalog = main.MaterialCatalog()
+        for material in main.normalize_catalog_changes(data)["added"]:
+            catalog.put(material)
+        return catalog
+
+    started = time.perf_counter()
+    catalog = build(json.loads(text))
+    parse_seconds = time.perf_counter() - started
+    count = max(1, len(catalog))
+
+    # 内存单独测一次，tracemalloc会拖慢解析
+    tracemalloc.start()
+    data = json.loads(text)
+    raw_bytes = tracemalloc.get_traced_memory()[0]
+    catalog = build(data)
+    del data
+    model_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    filters = []
+    for category in list(catalog.categories) + ["全部"]:
+        started = time.perf_counter()
+        list(catalog.in_category(category))
+        filters.append(time.perf_counter() - started)
+    return {
+        "materials": len(catalog),
+        "parse_ms": milliseconds(parse_seconds),
+        "json_bytes_per_material": raw_bytes // count,
+        "bytes_per_material": model_bytes // count,
+        "filter_ms": summarize(filters),
+    }
+
+
+def run_child(options):
+    from PyQt5.QtCore import QObject, QTimer, QEventLoop, QAbstractAnimation, Qt
+    from PyQt5.QtWidgets import QApplication
+    count = int(options["materials"])
+    main = isolate_client(options.get("workdir") or tempfile.mkdtemp(prefix="nextppt-benchmark-"), options["server"])
+    app = QApplication(sys.argv[:1])
+    app.setQuitOnLastWindowClosed(False)
+
+    marks = {}
+
+    # 记录第一张卡片的创建和绘制时间
+    class TimedCard(main.MaterialCard):
+        def __init__(self, material):
+            marks.setdefault("first_card", time.perf_counter())
+            super().__init__(material)
+
+        def paintEvent(self, event):
+            marks.setdefault("first_paint", time.perf_counter())
+            super().paintEvent(event)
+    main.MaterialCard = TimedCard
+
+    class StallMonitor(QObject):
+        """用定时器晚到的时间衡量事件循环卡顿，与主窗口的check_stall相同"""
+
+        def __init__(self):
+            super().__init__()
+            self.timer = QTimer(self)
+            self.timer.setTimerType(Qt.PreciseTimer)
+            self.timer.setInterval(int(STALL_INTERVAL * 1000))
+            self.timer.timeout.connect(self.tick)
+            self.late = []
+
+        def start(self):
+            self.late = []
+            self.expected = time.perf_counter() + STALL_INTERVAL
+            self.timer.start()
+
+        def tick(self):
+            now = time.perf_counter()
+            self.late.append(max(0.0, now - self.expected))
+            self.expected = now + STALL_INTERVAL
+
+        def stop(self):
+            self.timer.stop()
+            stalls = [late for late in self.late if late > main.METRICS_STALL_THRESHOLD]
+            result = summarize(self.late)
+            result["stalls"] = len(stalls)
+            result["stalled_ms"] = milliseconds(sum(stalls))
+            return result
+
+    def wait_until(predicate, timeout):
+        """运行事件循环直到predicate()为真或超时"""
+        loop = QEventLoop()
+        timer = QTimer()
+        timer.setInterval(2)
+        deadline = time.perf_counter() + timeout
+
+        def check():
+            if predicate() or time.perf_counter() > deadline:
+                loop.quit()
+        timer.timeout.connect(check)
+        timer.start()
+        loop.exec_()
+        timer.stop()
+
+    def wait_settled(window):
+        """等待卡片布局稳定，返回开始稳定的时间"""
+        layout = window.materials_layout
+        state = {"since": None}
+
+        def settled():
+            now = time.perf_counter()
+            # FlowLayout的防抖定时器和移动动画都没有在运行
+            if layout._deBounceTimer.isActive() or layout._aniGroup.state() != QAbstractAnimation.Stopped:
+                state["since"] = None
+                return False
+            if state["since"] is None:
+                state["since"] = now
+            return now - state["since"] >= SETTLE_QUIET
+        wait_until(settled, SETTLE_TIMEOUT)
+        return state["since"] or time.perf_counter()
+
+    result = {"materials": count, "catalog": measure_catalog(main, options["server"])}
+    memory_before = memory_usage()
+
+    # 启动到完整布局
+    started = time.perf_counter()
+    window = main.MainWindow()
+    window.show()
+    result["window_ms"] = milliseconds(time.perf_counter() - started)
+    settled = wait_settled(window)
+    result["first_card_ms"] = milliseconds(marks.get("first_card", settled) - started)
+    result["first_paint_ms"] = milliseconds(marks.get("first_paint", settled) - started)
+    result["full_layout_ms"] = milliseconds(settled - started)
+    result["cards"] = len(window.cards)
+
+    # 切换分类，最后切回"全部"
+    combobox = window.category_combobox
+    categories = [combobox.itemText(i) for i in range(1, combobox.count())][:CATEGORY_SWITCHES] + ["全部"]
+    switch, switch_settled = [], []
+    for category in categories:
+        started = time.perf_counter()
+        combobox.setCurrentText(category)
+        switch.append(time.perf_counter() - started)
+        switch_settled.append(wait_settled(window) - started)
+    result["category_switch_ms"] = summarize(switch)
+    result["category_switch_settled_ms"] = summarize(switch_settled)
+
+    # 显示全部课件时主窗口占用的内存（释放的内存不一定还给系统，所以按整个窗口平均到每张卡片）
+    memory_loaded = memory_usage()
+    if memory_loaded is not None and memory_before is not None:
+        result["memory_bytes"] = memory_loaded
+        result["memory_window_bytes"] = memory_loaded - memory_before
+        result["memory_per_card_bytes"] = result["memory_window_bytes"] // max(1, len(window.cards))
+
+    # 滚动：每16毫秒向下滚动三分之一屏，到底后回到顶部
+    scroll_area = window.findChild(main.SmoothScrollArea)
+    scroll_bar = scroll_area.verticalScrollBar()
+    step = max(1, scroll_area.viewport().height() // 3)
+    frames = {"left": SCROLL_FRAMES}
+
+    def scroll():
+        value = scroll_bar.value() + step
+        scroll_bar.setValue(0 if value > scroll_bar.maximum() else value)
+        frames["left"] -= 1
+    monitor = StallMonitor()
+    scroll_timer = QTimer()
+    scroll_timer.setInterval(16)
+    scroll_timer.timeout.connect(scroll)
+    scroll_bar.setValue(0)
+    monitor.start()
+    scroll_timer.start()
+    wait_until(lambda: frames["left"] <= 0, SCROLL_FRAMES)
+    scroll_timer.stop()
+    result["scroll"] = monitor.stop()
+    result["scroll"]["pixels"] = step * SCROLL_FRAMES
+    scroll_bar.setValue(0)
+
+    # 同时下载几个课件，下载窗口的进度每次都会刷新
+    downloads = int(options.get("downloads") or 0)
+    if downloads:
+        cards = list(window.cards.values())[:downloads]
+        finished = []
+        monitor.start()
+        started = time.perf_counter()
+        for card in cards:
+            card.download_material()
+            card.download_manager.complete_signal.connect(finished.append)
+            card.download_manager.error_signal.connect(finished.append)
+        wait_until(lambda: len(finished) >= len(cards), DOWNLOAD_TIMEOUT)
+        result["downloads"] = monitor.stop()
+        result["downloads"].update({
+            "files": len(cards),
+            "completed": sum(1 for card in cards if card.download_manager.completed),
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+        # 等下载窗口自动关闭
+        wait_until(lambda: False, 0.6)
+
+    window.close()
+    for card in window.cards.values():
+        manager = getattr(card, "download_manager", None)
+        if manager:
+            manager.wait()
+    with open(options["result"], "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    # 后台线程（目录同步、镜像测速等）不需要等待
+    os._exit(0)
+
+
+# ---------------- 主进程 ----------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(count, file_size):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, STUB_SERVER, f"--synthetic={count}",
+                               f"--file-size={file_size}", str(port)],
+                              stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{url}/api/categories", timeout=1)
+            return server, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("替身服务器没有启动")
+
+
+def run_size(count, downloads, file_size, timeout):
+    """启动替身服务器和测试子进程，返回一个目录规模的结果"""
+    server, url = start_stub_server(count, file_size)
+    workdir = tempfile.mkdtemp(prefix="nextppt-benchmark-")
+    result_path = os.path.join(workdir, "result.json")
+    try:
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child",
+                                f"--materials={count}", f"--server={url}",
+                                f"--downloads={downloads}", f"--workdir={workdir}", f"--result={result_path}"],
+                               env=env, timeout=timeout, cwd=tempfile.gettempdir(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if not os.path.exists(result_path):
+            error = child.stderr.decode("utf-8", "replace").strip().splitlines()
+            return {"materials": count, "error": error[-1] if error else f"退出码{child.returncode}"}
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"materials": count, "error": f"超过{timeout}秒"}
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def environment():
+    from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+    info = {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+    }
+    try:
+        from importlib.metadata import version
+        info["qfluentwidgets"] = version("PyQt-Fluent-Widgets")
+    except Exception:
+        pass
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                        capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        pass
+    return info
+
+
+def flatten(result, prefix=""):
+    """把嵌套的结果展开为 {"scroll.max": 数值} 的形式，便于对比"""
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(old, new):
+    """逐项打印新旧结果的变化"""
+    old_results = {result["materials"]: flatten(result) for result in old.get("results", [])}
+    lines = [f"{'课件数':>8}  {'指标':<36}{'旧':>14}{'新':>14}{'变化':>10}"]
+    for result in new["results"]:
+        before = old_results.get(result["materials"])
+        if before is None:
+            continue
+        for key, value in flatten(result).items():
+            if key == "materials" or key not in before:
+                continue
+            change = f"{(value - before[key]) / before[key] * 100:+.1f}%" if before[key] else "-"
+            lines.append(f"{result['materials']:>8}  {key:<36}{before[key]:>14}{value:>14}{change:>10}")
+    return "\n".join(lines)
+
+
+def main():
+    options = parse_options(sys.argv[1:])
+    if "child" in options:
+        run_child(options)
+        return
+    if "help" in options:
+        print(__doc__)
+        return
+
+    sizes = [int(size) for size in options["sizes"].split(",")] if options.get("sizes") else DEFAULT_SIZES
+    downloads = int(options.get("downloads") or DEFAULT_DOWNLOADS)
+    file_size = int(options.get("file-size") or DEFAULT_FILE_SIZE)
+    timeout = int(options.get("timeout") or CHILD_TIMEOUT)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {"sizes": sizes, "downloads": downloads, "file_size": file_size, "timeout": timeout},
+        "results": [],
+    }
+    for count in sizes:
+        print(f"测试{count}个课件...", file=sys.stderr)
+        report["results"].append(run_size(count, downloads, file_size, timeout))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if options.get("output"):
+        with open(options["output"], "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    if options.get("compare"):
+        with open(options["compare"], "r", encoding="utf-8") as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
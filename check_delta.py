@@ -0,0 +1,124 @@
+"""增量更新检查：用本地替身服务器验证修改过的课件只下载变化的部分，并能拼装出正确的文件
+
+用法: python check_delta.py
+
+在临时目录中生成一个课件，先完整下载一次；然后在文件中间插入和改写一些字节
+（模拟增删幻灯片），重启替身服务器后再下载。检查第二次下载使用了分块签名、
+大部分内容来自本地旧版本，并且拼装结果的sha256与服务器上的文件一致。
+通过时退出码为0，否则为1。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STUB_SERVER = os.path.join(ROOT, "stub_server.py")
+
+FILE_SIZE = 4 * 1024 * 1024
+MAX_REMOTE_RATIO = 0.25  # 第二次下载从服务器获取的字节数不应超过文件大小的这个比例
+
+
+def start_server(root):
+    from benchmark import free_port
+    port = free_port()
+    server = subprocess.Popen([sys.executable, STUB_SERVER, root, str(port)], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            return server, url, requests.get(f"{url}/api/materials", timeout=1).json()[0]
+        except requests.RequestException:
+            server.poll()
+            if server.returncode is not None:
+                break
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("替身服务器没有启动")
+
+
+def download(main, app, material):
+    """用DownloadManager下载课件，返回 (下载管理器, 结果路径或错误)"""
+    from PyQt5.QtCore import QTimer
+    manager = main.DownloadManager(material["fileUrl"],
+                                   os.path.join(main.DOWNLOAD_DIR, os.path.basename(material["fileUrl"])),
+                                   material["id"], material["title"], material["hash"], material["uploadDate"])
+    result = {}
+    manager.complete_signal.connect(lambda path: (result.setdefault("path", path), app.quit()))
+    manager.error_signal.connect(lambda error: (result.setdefault("error", error), app.quit()))
+    QTimer.singleShot(60000, app.quit)
+    manager.start()
+    app.exec_()
+    manager.wait()
+    return manager, result
+
+
+def run_check():
+    from PyQt5.QtCore import QCoreApplication
+    from benchmark import isolate_client
+
+    workdir = tempfile.mkdtemp(prefix="nextppt-delta-")
+    server = None
+    try:
+        served = os.path.join(workdir, "server", "语文")
+        os.makedirs(served)
+        deck = os.path.join(served, "deck.pptx")
+        rng = random.Random(1)
+        with open(deck, "wb") as f:
+            f.write(rng.randbytes(FILE_SIZE))
+
+        server, url, material = start_server(os.path.dirname(served))
+        os.makedirs(os.path.join(workdir, "client"))
+        main = isolate_client(os.path.join(workdir, "client"), url)
+        app = QCoreApplication(sys.argv[:1])
+        _, first = download(main, app, material)
+        if "error" in first:
+            print(f"第一次下载失败: {first['error']}")
+            return 1
+
+        # 插入一段新内容，再改写后面的一小段
+        with open(deck, "rb") as f:
+            data = bytearray(f.read())
+        data[FILE_SIZE // 4:FILE_SIZE // 4] = rng.randbytes(3000)
+        data[FILE_SIZE * 3 // 4:FILE_SIZE * 3 // 4 + 500] = rng.randbytes(500)
+        with open(deck, "wb") as f:
+            f.write(data)
+        expected = hashlib.sha256(data).hexdigest()
+        server.terminate()
+        server.wait()
+        server, url, material = start_server(os.path.dirname(served))
+        main.mirror_pool = main.MirrorPool([url])
+
+        manager, second = download(main, app, material)
+        if "error" in second:
+            print(f"第二次下载失败: {second['error']}")
+            return 1
+        local = sum(item[2] for item in manager.plan if item[0] == "local")
+        remote = sum(item[2] - item[1] + 1 for item in manager.plan if item[0] == "remote")
+        with open(second["path"], "rb") as f:
+            actual = hashlib.sha256(f.read()).hexdigest()
+        print(json.dumps({"size": len(data), "local_bytes": local, "remote_bytes": remote,
+                          "sha256_matches": actual == expected}, ensure_ascii=False))
+        if not local or remote > len(data) * MAX_REMOTE_RATIO:
+            print("增量更新没有生效")
+            return 1
+        if actual != expected:
+            print("拼装结果的sha256不一致")
+            return 1
+        print("增量更新检查通过")
+        return 0
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(run_check())
@@ -0,0 +1,148 @@
+"""增量更新的分块签名和拼装计划，客户端（main.py）和替身服务器（stub_server.py）共用
+
+签名格式: {"size": 文件大小, "blockSize": 块大小, "sha256": 整个文件的哈希,
+           "blocks": [[弱校验和, 块的MD5], ...]}
+只依赖标准库，服务器端生成签名时不需要安装界面库。
+"""
+import os
+import array
+import hashlib
+import operator
+import itertools
+
+BLOCK_SIZE = 64 * 1024  # 生成签名时的块大小
+MAX_RANGES = 32  # 拼装计划中最多的下载区间数
+SEARCH_WINDOW = 1024 * 1024  # 滚动查找时每次扫描的本地数据量
+
+
+def weak_checksum(data):
+    """计算一个块的弱校验和（与rolling_weak_checksums的结果一致）"""
+    s1 = sum(data)
+    s2 = sum(map(operator.mul, range(len(data), 0, -1), data))
+    return (s1 & 0xffff) | ((s2 & 0xffff) << 16)
+
+
+def rolling_weak_checksums(data, block_size):
+    """计算data中每个起始位置上长度为block_size的窗口的弱校验和
+
+    利用前缀和把滚动计算交给map/accumulate完成，避免逐字节的Python循环。
+    """
+    n = len(data) - block_size + 1
+    if n <= 0:
+        return []
+    # P[k] = x0 + ... + x(k-1)，Q[k] = 0*x0 + ... + (k-1)*x(k-1)
+    prefix = array.array("q", [0])
+    prefix.extend(itertools.accumulate(data))
+    weighted = array.array("q", [0])
+    weighted.extend(itertools.accumulate(map(operator.mul, range(len(data)), data)))
+    s1 = array.array("q", map(operator.sub, prefix[block_size:], prefix[:n]))
+    # s2 = (i + B) * s1 - (Q[i+B] - Q[i])
+    s2 = map(operator.sub, map(operator.mul, range(block_size, block_size + n), s1),
+             map(operator.sub, weighted[block_size:], weighted[:n]))
+    return list(map(lambda a, b: (a & 0xffff) | ((b & 0xffff) << 16), s1, s2))
+
+
+def build_signature(path, block_size=BLOCK_SIZE):
+    """生成文件的分块签名，供服务器发布"""
+    blocks = []
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+            blocks.append([weak_checksum(block), hashlib.md5(block).hexdigest()])
+    return {"size": os.path.getsize(path), "blockSize": block_size,
+            "sha256": sha256.hexdigest(), "blocks": blocks}
+
+
+def build_delta_plan(base_path, signature, max_ranges=MAX_RANGES, search_window=SEARCH_WINDOW):
+    """对比本地旧文件与服务器签名，生成新文件的拼装计划
+
+    返回按新文件顺序排列的列表，每项为 ("local", 旧文件偏移, 长度) 或
+    ("remote", 起始字节, 结束字节)。旧文件中内容整体前后移动（例如插入或删除了
+    一页幻灯片）时，通过滚动校验和找到新的对齐位置。
+    """
+    size = signature["size"]
+    block_size = signature["blockSize"]
+    blocks = signature["blocks"]
+    base_size = os.path.getsize(base_path)
+    # 弱校验和 -> 块序号列表（最后一个不完整的块总是从服务器下载）
+    table = {}
+    full_blocks = size // block_size
+    for k in range(full_blocks):
+        table.setdefault(blocks[k][0], []).append(k)
+
+    found = {}
+    k = 0
+    delta = 0
+    searched_until = 0
+    with open(base_path, "rb") as f:
+        while k < full_blocks:
+            # 先按当前的偏移量对齐比较
+            offset = k * block_size + delta
+            if 0 <= offset <= base_size - block_size:
+                f.seek(offset)
+                if hashlib.md5(f.read(block_size)).hexdigest() == blocks[k][1]:
+                    found[k] = offset
+                    k += 1
+                    continue
+            # 对齐位置不匹配，在旧文件中向后滚动查找后续块，已扫描过的区域不再重复扫描
+            hit = None
+            start = max(offset - block_size, searched_until, 0)
+            while hit is None and start <= base_size - block_size:
+                end = min(start + search_window, base_size - block_size + 1)
+                f.seek(start)
+                data = f.read(end - start + block_size - 1)
+                weak = rolling_weak_checksums(data, block_size)
+                for i in itertools.compress(range(len(weak)), map(table.__contains__, weak)):
+                    candidates = [j for j in table[weak[i]] if j >= k]
+                    if not candidates:
+                        continue
+                    strong = hashlib.md5(data[i:i + block_size]).hexdigest()
+                    j = next((j for j in candidates if blocks[j][1] == strong), None)
+                    if j is not None:
+                        hit = (j, start + i)
+                        break
+                searched_until = start + i + 1 if hit else end
+                start = end
+            if hit is None:
+                break
+            j, offset = hit
+            found[j] = offset
+            delta = offset - j * block_size
+            k = j + 1
+
+    # 按新文件顺序生成计划，相邻的同类区间合并
+    plan = []
+    for k in range((size + block_size - 1) // block_size):
+        start = k * block_size
+        length = min(block_size, size - start)
+        if k in found:
+            if plan and plan[-1][0] == "local" and plan[-1][1] + plan[-1][2] == found[k]:
+                plan[-1] = ("local", plan[-1][1], plan[-1][2] + length)
+            else:
+                plan.append(("local", found[k], length))
+        elif plan and plan[-1][0] == "remote":
+            plan[-1] = ("remote", plan[-1][1], start + length - 1)
+        else:
+            plan.append(("remote", start, start + length - 1))
+
+    # 需要下载的区间太多时，把间隔最小的几段连同中间的本地数据一起下载
+    remote = [i for i, item in enumerate(plan) if item[0] == "remote"]
+    if len(remote) > max_ranges:
+        gaps = sorted(range(len(remote) - 1),
+                      key=lambda g: plan[remote[g + 1]][1] - plan[remote[g]][2])
+        bridged = set(gaps[:len(remote) - max_ranges])
+        merged = []
+        i = 0
+        while i < len(plan):
+            item = plan[i]
+            if item[0] == "remote":
+                g = remote.index(i)
+                while g in bridged:
+                    g += 1
+                item = ("remote", item[1], plan[remote[g]][2])
+                i = remote[g]
+            merged.append(item)
+            i += 1
+        plan = merged
+    return plan
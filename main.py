@@ -1,30 +1,98 @@
 import sys
 import os
 import json
+
+# 只运行一个实例：再次启动时把参数（课件ID）交给已经运行的实例后立即退出。
+# 在导入界面库和其他模块之前检查，再次启动只需要几十毫秒。
+SINGLE_INSTANCE = True
+INSTANCE_TIMEOUT = 1000  # 连接已运行的实例并等待确认的最长时间（毫秒）
+
+def instance_server_name():
+    """实例之间通信的本地通道名称，每个用户一个（Windows上是命名管道，其他系统是本地套接字）"""
+    user = os.environ.get("USERNAME") or os.environ.get("USER") or ""
+    return f"NextPPT-Client-{user}"
+
+def forward_to_running_instance(args):
+    """把启动参数交给已经运行的实例，成功返回True"""
+    from PyQt5.QtNetwork import QLocalSocket
+    connection = QLocalSocket()
+    connection.connectToServer(instance_server_name())
+    if not connection.waitForConnected(INSTANCE_TIMEOUT):
+        return False
+    if sys.platform == "win32":
+        # 允许已运行的实例把窗口切换到前台（ASFW_ANY）
+        import ctypes
+        ctypes.windll.user32.AllowSetForegroundWindow(-1)
+    connection.write(json.dumps({"args": args}).encode("utf-8") + b"\n")
+    connection.waitForBytesWritten(INSTANCE_TIMEOUT)
+    # 等对方确认收到后再退出
+    connection.waitForReadyRead(INSTANCE_TIMEOUT)
+    connection.disconnectFromServer()
+    return True
+
+def is_multiprocessing_child():
+    """是否是multiprocessing启动的子进程（打包成exe后子进程也以__main__运行，参数中带--multiprocessing-fork）"""
+    return "--multiprocessing-fork" in sys.argv
+
+if (SINGLE_INSTANCE and __name__ == "__main__" and not is_multiprocessing_child()
+        and forward_to_running_instance(sys.argv[1:])):
+    sys.exit(0)
+
+import time
+import queue
+import uuid
+import random
+import itertools
+import contextlib
+import shutil
+import hashlib
+import re
+import socket
 import requests
 import threading
+import http.server
+import concurrent.futures
+import multiprocessing
+import zipfile
+import tarfile
+import logging
+import logging.handlers
+from xml.etree import ElementTree
+from requests.adapters import HTTPAdapter
 import subprocess
 from datetime import datetime
+from delta import build_delta_plan
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QListWidgetItem, QLabel, QScrollArea, QStackedWidget,
                              QGridLayout, QFrame, QProgressBar, QMessageBox, QFileDialog,
                              QDialog, QPushButton, QComboBox)
-from PyQt5.QtCore import Qt, QSize, QThread, pyqtSignal, QUrl, QRect, QTimer, QPropertyAnimation, QEasingCurve
+from PyQt5.QtCore import Qt, QObject, QSize, QThread, pyqtSignal, QUrl, QRect, QTimer, QPropertyAnimation, QEasingCurve
 from PyQt5.QtGui import QIcon, QPixmap, QFont, QDesktopServices, QFontDatabase
+from PyQt5.QtNetwork import QLocalServer
 
 # 导入QFluentWidgets库
 from qfluentwidgets import (FluentWindow, NavigationInterface, NavigationItemPosition, 
                            ScrollArea, PushButton, ProgressBar, ListWidget, MessageBox,
                            FluentIcon, setTheme, Theme, isDarkTheme, FluentStyleSheet,
                            CardWidget, BodyLabel, CaptionLabel, StrongBodyLabel, TitleLabel,
-                           FlowLayout, SmoothScrollArea, SubtitleLabel, TransparentPushButton)
+                           FlowLayout, SmoothScrollArea, SubtitleLabel, TransparentPushButton,
+                           CheckBox, TogglePushButton, RoundMenu, Action)
+
+# HTTP/2传输是可选功能，需要 pip install "httpx[http2]"
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 # 服务器地址
 SERVER_URL = ""
+# 其他镜像服务器（与SERVER_URL提供相同的文件），例如 ["http://campus-server:3000"]
+SERVER_MIRRORS = []
 
 # 下载配置
 DOWNLOAD_THREADS = 32
-DOWNLOAD_DIR = "D:/NextPPT" if os.path.exists("D:/") else "C:/NextPPT"
+# 可以用环境变量NEXTPPT_DOWNLOAD_DIR指定其他目录（测试脚本用它避免读写真实的下载记录）
+DOWNLOAD_DIR = os.environ.get("NEXTPPT_DOWNLOAD_DIR") or ("D:/NextPPT" if os.path.exists("D:/") else "C:/NextPPT")
 
 # 确保下载目录存在
 if not os.path.exists(DOWNLOAD_DIR):
@@ -40,148 +108,2199 @@ if not os.path.exists(DOWNLOAD_RECORD_FILE):
     with open(DOWNLOAD_RECORD_FILE, "w", encoding="utf-8") as f:
         json.dump([], f)
 
+# 传输配置
+# "http1": HTTP/1.1连接池（默认）
+# "http2": 所有请求作为少数几个连接上的多路复用流，HTTPS下通过ALPN协商，服务器不支持时自动回到HTTP/1.1
+# "h2c":   明文HTTP/2（服务器必须支持HTTP/2，例如反向代理内网地址）
+DOWNLOAD_TRANSPORT = "http1"
+HTTP2_MAX_CONNECTIONS = 2  # 每个服务器最多建立的HTTP/2连接数
+HTTP1_POOL_SIZE = 64  # 每个服务器保持的HTTP/1.1连接数
+
+# HTTP/2响应包装类，提供与requests.Response相同的用法
+class Http2Response:
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.http_version = response.http_version
+        self.chunks = None
+        self.pending = None
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} {self.response.reason_phrase}", response=self)
+    
+    @property
+    def raw(self):
+        # 与requests一样通过response.raw.readinto()读取数据
+        return self
+    
+    @property
+    def encoding(self):
+        return self.response.encoding
+    
+    @encoding.setter
+    def encoding(self, value):
+        # 与requests一样，在读取文本之前设置解码文本使用的编码
+        self.response.encoding = value
+    
+    def readinto(self, buffer):
+        """把收到的数据复制到buffer中，返回复制的字节数，0表示数据已读完"""
+        with translate_httpx_errors():
+            while not self.pending:
+                if self.chunks is None:
+                    self.chunks = self.response.iter_raw()
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    return 0
+                self.pending = memoryview(chunk)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+    
+    def read(self, n=-1):
+        """读取最多n字节，供tarfile等按文件对象读取"""
+        if n < 0:
+            return b"".join(iter(lambda: self.read(1024 * 1024), b""))
+        buffer = bytearray(n)
+        return bytes(buffer[:self.readinto(buffer)])
+    
+    def iter_lines(self, decode_unicode=True):
+        """按行返回文本，使用encoding解码（没有设置时用响应头中的charset，再没有则为UTF-8）"""
+        with translate_httpx_errors():
+            yield from self.response.iter_lines()
+    
+    def json(self):
+        with translate_httpx_errors():
+            self.response.read()
+        return self.response.json()
+    
+    def close(self):
+        self.response.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+@contextlib.contextmanager
+def translate_httpx_errors():
+    """把httpx的异常转换为requests的异常，调用方只需处理一种"""
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e))
+    except httpx.HTTPError as e:
+        raise requests.ConnectionError(str(e))
+
+# HTTP传输类
+class Transport:
+    """所有请求共用的连接池，避免每个分段都新建TCP连接"""
+    
+    def __init__(self, mode):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP1_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.client = None
+        if mode in ("http2", "h2c"):
+            try:
+                self.client = httpx.Client(
+                    http1=mode == "http2", http2=True,
+                    limits=httpx.Limits(max_connections=HTTP2_MAX_CONNECTIONS,
+                                        max_keepalive_connections=HTTP2_MAX_CONNECTIONS))
+            except (AttributeError, ImportError) as e:
+                # 没有安装httpx或h2
+                print(f"HTTP/2不可用，使用HTTP/1.1: {e}")
+    
+    def request(self, method, url, stream=False, timeout=None, **kwargs):
+        if self.client is None:
+            return self.session.request(method, url, stream=stream, timeout=timeout, **kwargs)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0], pool=60)
+        with translate_httpx_errors():
+            request = self.client.build_request(method, url, timeout=timeout, **kwargs)
+            response = Http2Response(self.client.send(request, stream=stream))
+        if response.http_version != "HTTP/2":
+            # 服务器不支持HTTP/2，之后的请求改用HTTP/1.1连接池，避免被限制在少数几个连接上
+            print("服务器不支持HTTP/2，改用HTTP/1.1连接池")
+            self.client = None
+        return response
+    
+    def abort(self, response):
+        """在其他线程中立即中止响应
+
+        直接close会等待正在进行的读取结束，这里先关闭底层socket让阻塞的读取马上返回，
+        连接不会再放回连接池。HTTP/2的流共用连接，只关闭这个流。
+        """
+        connection = getattr(getattr(response, "raw", None), "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is None:
+            response.close()
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+transport = Transport(DOWNLOAD_TRANSPORT)
+
+# 镜像健康检查配置
+MIRROR_PROBE_INTERVAL = 30  # 定时测量各镜像延迟的间隔（秒）
+MIRROR_RETRY_BASE = 5  # 镜像出错后暂停使用的时间（秒），连续出错时翻倍
+MIRROR_RETRY_MAX = 300
+MIRROR_EWMA_ALPHA = 0.3  # 延迟和速度评分的平滑系数
+
+# 镜像服务器池类
+class MirrorPool:
+    """记录每个镜像的延迟、下载速度和健康状况，为请求选择镜像"""
+
+    def __init__(self, urls):
+        self.lock = threading.Lock()
+        self.mirrors = {url: {"latency": None, "throughput": None, "failures": 0, "down_until": 0}
+                        for url in urls}
+        self.probe_thread = None
+
+    def url(self, mirror, path):
+        # 服务器返回完整地址时直接使用
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{mirror}{path}"
+
+    def ranked(self):
+        """按延迟从低到高排列的镜像，暂停使用的镜像排在最后（全部出错时仍可尝试）"""
+        now = time.monotonic()
+        with self.lock:
+            items = list(self.mirrors.items())
+        return [url for url, _ in sorted(
+            items, key=lambda item: (item[1]["down_until"] > now, item[1]["latency"] or 0))]
+
+    def best(self):
+        return self.ranked()[0]
+
+    def candidates(self, exclude=None):
+        """健康的镜像（尽量不包含exclude），返回 [(地址, 状态), ...]"""
+        now = time.monotonic()
+        with self.lock:
+            healthy = [(url, m) for url, m in self.mirrors.items() if m["down_until"] <= now]
+        others = [(url, m) for url, m in healthy if url != exclude]
+        return others or healthy
+
+    def pick(self, exclude=None):
+        """按下载速度加权随机选择一个健康的镜像，速度越快被选中的机会越大"""
+        candidates = self.candidates(exclude)
+        if not candidates:
+            return self.best()
+        # 还没有测速的镜像按已知速度的平均值计算，保证它也能分到请求
+        known = [m["throughput"] for _, m in candidates if m["throughput"]]
+        default = sum(known) / len(known) if known else 1
+        weights = [m["throughput"] or default for _, m in candidates]
+        return random.choices([url for url, _ in candidates], weights)[0]
+
+    def record_latency(self, mirror, seconds):
+        with self.lock:
+            m = self.mirrors.get(mirror)
+            if m is None:
+                return
+            m["latency"] = self.smooth(m["latency"], seconds)
+            m["failures"] = 0
+            m["down_until"] = 0
+
+    def record_throughput(self, mirror, nbytes, seconds):
+        # 数据量太小时测得的速度主要反映延迟，不计入
+        if seconds <= 0 or nbytes < 64 * 1024:
+            return
+        with self.lock:
+            m = self.mirrors.get(mirror)
+            if m is not None:
+                m["throughput"] = self.smooth(m["throughput"], nbytes / seconds)
+
+    def record_failure(self, mirror):
+        with self.lock:
+            m = self.mirrors.get(mirror)
+            if m is None:
+                return
+            m["failures"] += 1
+            pause = min(MIRROR_RETRY_BASE * (2 ** (m["failures"] - 1)), MIRROR_RETRY_MAX)
+            m["down_until"] = time.monotonic() + pause
+
+    def smooth(self, old, new):
+        return new if old is None else old + MIRROR_EWMA_ALPHA * (new - old)
+
+    def request(self, method, path, **kwargs):
+        """依次尝试各镜像（最快的优先）直到成功，返回响应"""
+        error = None
+        for mirror in self.ranked():
+            started = time.monotonic()
+            try:
+                response = transport.request(method, self.url(mirror, path), **kwargs)
+            except requests.RequestException as e:
+                self.record_failure(mirror)
+                error = e
+                continue
+            if response.status_code >= 500:
+                self.record_failure(mirror)
+                error = requests.HTTPError(f"{mirror} 返回 {response.status_code}", response=response)
+                continue
+            self.record_latency(mirror, time.monotonic() - started)
+            return response
+        raise error
+
+    def start_probing(self):
+        """只有一个服务器时不需要测量"""
+        if len(self.mirrors) > 1 and self.probe_thread is None:
+            self.probe_thread = threading.Thread(target=self.probe_loop, daemon=True)
+            self.probe_thread.start()
+
+    def probe_loop(self):
+        while True:
+            for mirror in list(self.mirrors):
+                started = time.monotonic()
+                try:
+                    transport.request("HEAD", f"{mirror}/api/categories", timeout=5).raise_for_status()
+                    self.record_latency(mirror, time.monotonic() - started)
+                except requests.RequestException:
+                    self.record_failure(mirror)
+            time.sleep(MIRROR_PROBE_INTERVAL)
+
+mirror_pool = MirrorPool([SERVER_URL] + SERVER_MIRRORS)
+
+# 内容寻址存储目录（按文件内容的SHA-256保存，用户看到的文件是指向这里的硬链接）
+STORE_DIR = os.path.join(DOWNLOAD_DIR, ".store")
+STORE_INDEX_FILE = os.path.join(STORE_DIR, "index.json")
+
+# 内容寻址存储类
+class ContentStore:
+    """按内容哈希保存下载文件，相同内容只保存一份"""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.lock = threading.Lock()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        # 索引: {"urls": {文件URL: {"hash": 哈希, "revision": 版本}}, "objects": {哈希: 文件大小}}
+        self.index = {"urls": {}, "objects": {}}
+        try:
+            with open(STORE_INDEX_FILE, "r", encoding="utf-8") as f:
+                self.index.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def new_temp_path(self):
+        return os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.tmp")
+
+    def lookup(self, url, digest=None, revision=None):
+        """返回本地已有对象的哈希，没有则返回None（不访问网络）
+
+        没有提供哈希时按URL查找，此时文件版本（上传日期）变化视为未命中；
+        哈希和版本都没有时无法判断本地内容是否过期，也视为未命中。
+        """
+        if not digest:
+            if not revision:
+                return None
+            with self.lock:
+                entry = self.index["urls"].get(url)
+            if not entry or entry.get("revision") != revision:
+                return None
+            digest = entry["hash"]
+        return digest if self.has_object(digest) else None
+
+    def previous(self, url):
+        """返回该URL上一次下载的内容在存储中的路径，用作增量更新的基准"""
+        with self.lock:
+            entry = self.index["urls"].get(url)
+        if entry and self.has_object(entry["hash"]):
+            return self.object_path(entry["hash"])
+        return None
+
+    def has_object(self, digest):
+        with self.lock:
+            size = self.index["objects"].get(digest)
+        if size is None:
+            return False
+        try:
+            # 只比较大小，避免每次都重新计算哈希
+            return os.path.getsize(self.object_path(digest)) == size
+        except OSError:
+            return False
+
+    def commit(self, temp_path, digest, url, revision=None):
+        """把已计算好哈希的临时文件移入存储，内容重复时直接丢弃临时文件"""
+        target = self.object_path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, target)
+        with self.lock:
+            self.index["urls"][url] = {"hash": digest, "revision": revision}
+            self.index["objects"][digest] = os.path.getsize(target)
+            self.save_index()
+        return target
+
+    def materialize(self, digest, file_name, replaces=None):
+        """在下载目录中生成用户可见的文件，返回其路径
+
+        同名但内容不同的文件不会被覆盖，而是在文件名后追加序号；
+        只有内容是replaces（同一课件的旧版本）的同名文件会被替换。
+        """
+        source = self.object_path(digest)
+        base, ext = os.path.splitext(file_name)
+        n = 0
+        while True:
+            name = file_name if n == 0 else f"{base} ({n}){ext}"
+            path = os.path.join(DOWNLOAD_DIR, name)
+            if not os.path.exists(path):
+                break
+            if self.same_content(path, digest):
+                return path
+            if replaces and self.same_content(path, os.path.basename(replaces)):
+                os.remove(path)
+                break
+            n += 1
+        try:
+            os.link(source, path)
+        except OSError:
+            # 文件系统不支持硬链接时退回到复制
+            shutil.copyfile(source, path)
+        return path
+
+    def same_content(self, path, digest):
+        """path的内容是否为存储中的digest对象
+
+        硬链接直接比较是否为同一文件；不支持硬链接时文件是复制的，比较大小和哈希。
+        """
+        source = self.object_path(digest)
+        try:
+            if os.path.samefile(path, source):
+                return True
+            if os.path.getsize(path) != os.path.getsize(source):
+                return False
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(block)
+        except OSError:
+            return False
+        return sha256.hexdigest() == digest
+    
+    def usage(self):
+        """返回 {哈希: 文件大小}，按索引统计占用空间，不扫描目录"""
+        with self.lock:
+            return dict(self.index["objects"])
+    
+    def remove(self, digest):
+        """删除一个对象及指向它的URL记录"""
+        try:
+            os.remove(self.object_path(digest))
+        except OSError:
+            pass
+        with self.lock:
+            self.index["objects"].pop(digest, None)
+            self.index["urls"] = {url: entry for url, entry in self.index["urls"].items()
+                                  if entry["hash"] != digest}
+            self.save_index()
+    
+    def save_index(self):
+        temp_path = f"{STORE_INDEX_FILE}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(temp_path, STORE_INDEX_FILE)
+
+content_store = ContentStore(STORE_DIR)
+
+# 增量更新配置
+# 服务器在 文件URL + DELTA_SIGNATURE_SUFFIX 处发布分块签名（JSON）:
+# {"size": 文件大小, "blockSize": 块大小, "sha256": 整个文件的哈希,
+#  "blocks": [[弱校验和, 块的MD5], ...]}，可用 delta.build_signature() 生成
+DELTA_UPDATES = True
+DELTA_SIGNATURE_SUFFIX = ".sig"
+# 需要下载的数据超过文件大小的这个比例时直接完整下载
+DELTA_MAX_RATIO = 0.8
+# 滚动查找时每次扫描的本地数据量
+DELTA_SEARCH_WINDOW = 1024 * 1024
+
+# 局域网节点缓存配置（默认关闭）
+# 开启后客户端在局域网中广播自己的存在，并通过HTTP向其他客户端提供存储中的文件（按内容哈希访问）。
+# 下载已知哈希的课件时优先从拥有该文件的节点下载，节点不可用时回到服务器，下载结果按哈希校验。
+PEER_CACHE_ENABLED = False
+PEER_PORT = 45680  # 提供文件的HTTP端口，0表示随机端口（同一台电脑运行多个实例时使用）
+PEER_DISCOVERY_PORT = 45679  # 广播发现使用的UDP端口
+PEER_DISCOVERY_ADDRESS = "255.255.255.255"
+PEER_ANNOUNCE_INTERVAL = 10  # 广播间隔（秒），超过3个间隔没有收到广播的节点视为离线
+PEER_ADDRESSES = []  # 固定的节点地址，例如 ["http://192.168.1.20:45680"]，用于禁止广播的网络
+PEER_QUERY_TIMEOUT = 1  # 询问节点是否有某个文件的超时（秒）
+
+# 局域网节点提供文件的请求处理类
+class PeerRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_HEAD(self):
+        self.serve(send_body=False)
+    
+    def do_GET(self):
+        self.serve(send_body=True)
+    
+    def serve(self, send_body):
+        # 只提供存储中的对象，地址为 /objects/<sha256>
+        digest = self.path.rsplit("/", 1)[-1]
+        if (not self.path.startswith("/objects/") or len(digest) != 64
+                or any(c not in "0123456789abcdef" for c in digest)
+                or not content_store.has_object(digest)):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        path = content_store.object_path(digest)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not send_body:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(DISK_BUFFER_SIZE, remaining))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
+
+# 局域网节点缓存类
+class PeerCache:
+    """在局域网中发现其他客户端，并向它们提供本机存储中的文件"""
+    
+    def __init__(self):
+        self.peer_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.peers = {}  # 节点ID -> (地址, 最后一次收到广播的时间)
+        self.server = None
+        self.started = False
+    
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        try:
+            self.server = http.server.ThreadingHTTPServer(("", PEER_PORT), PeerRequestHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        except OSError as e:
+            # 端口被占用时不向其他节点提供文件，但仍然可以从其他节点下载
+            self.server = None
+            print(f"启动局域网共享服务失败: {e}")
+        threading.Thread(target=self.discovery_loop, daemon=True).start()
+    
+    def discovery_loop(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            # 同一台电脑上的多个实例都能收到广播
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        try:
+            sock.bind(("", PEER_DISCOVERY_PORT))
+        except OSError as e:
+            print(f"启动局域网节点发现失败: {e}")
+            sock.close()
+            return
+        sock.settimeout(PEER_ANNOUNCE_INTERVAL)
+        # 没有启动文件服务时只接收其他节点的广播
+        announcement = self.server and json.dumps({"app": "NextPPT", "id": self.peer_id,
+                                                   "port": self.server.server_address[1]}).encode()
+        next_announce = 0
+        while True:
+            if announcement and time.monotonic() >= next_announce:
+                try:
+                    sock.sendto(announcement, (PEER_DISCOVERY_ADDRESS, PEER_DISCOVERY_PORT))
+                except OSError as e:
+                    print(f"局域网广播失败: {e}")
+                next_announce = time.monotonic() + PEER_ANNOUNCE_INTERVAL
+            try:
+                data, (host, _) = sock.recvfrom(1024)
+                message = json.loads(data)
+            except (socket.timeout, ValueError):
+                continue
+            except OSError as e:
+                print(f"接收局域网广播失败: {e}")
+                time.sleep(PEER_ANNOUNCE_INTERVAL)
+                continue
+            if message.get("app") == "NextPPT" and message.get("id") != self.peer_id:
+                with self.lock:
+                    self.peers[message["id"]] = (f"http://{host}:{int(message['port'])}", time.monotonic())
+    
+    def addresses(self):
+        """当前在线的节点地址"""
+        deadline = time.monotonic() - PEER_ANNOUNCE_INTERVAL * 3
+        with self.lock:
+            found = [address for address, seen in self.peers.values() if seen >= deadline]
+        return list(dict.fromkeys(PEER_ADDRESSES + found))
+    
+    def find(self, digest, size):
+        """同时询问所有节点，返回拥有该文件（大小一致）的节点地址"""
+        def has_object(address):
+            try:
+                response = transport.session.head(f"{address}/objects/{digest}", timeout=PEER_QUERY_TIMEOUT)
+                return response.status_code == 200 and int(response.headers.get("Content-Length", -1)) == size
+            except requests.RequestException:
+                return False
+        addresses = self.addresses()
+        if not addresses:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(addresses), 16)) as executor:
+            return [a for a, ok in zip(addresses, executor.map(has_object, addresses)) if ok]
+
+peer_cache = PeerCache()
+
+# 一次下载使用的节点池类
+class PeerPool(MirrorPool):
+    """优先从拥有该文件的局域网节点下载，节点都不可用时交给服务器镜像池"""
+    
+    def __init__(self, peers, digest):
+        super().__init__(peers)
+        self.digest = digest
+    
+    def url(self, mirror, path):
+        if mirror in self.mirrors:
+            return f"{mirror}/objects/{self.digest}"
+        return mirror_pool.url(mirror, path)
+    
+    def pick(self, exclude=None):
+        if not self.candidates(exclude):
+            return mirror_pool.pick(exclude)
+        return super().pick(exclude)
+    
+    def record_latency(self, mirror, seconds):
+        pool = super() if mirror in self.mirrors else mirror_pool
+        pool.record_latency(mirror, seconds)
+    
+    def record_throughput(self, mirror, nbytes, seconds):
+        pool = super() if mirror in self.mirrors else mirror_pool
+        pool.record_throughput(mirror, nbytes, seconds)
+    
+    def record_failure(self, mirror):
+        pool = super() if mirror in self.mirrors else mirror_pool
+        pool.record_failure(mirror)
+
+# 网络超时与重试配置
+DOWNLOAD_CONNECT_TIMEOUT = 5  # 连接超时（秒）
+DOWNLOAD_READ_TIMEOUT = 15  # 读取超时（秒），超过这个时间没有收到数据视为连接卡死
+SEGMENT_RETRIES = 5  # 每个分段连续失败的最大重试次数
+RETRY_BACKOFF = 0.5  # 第一次重试前的等待时间（秒），之后每次翻倍
+RETRY_BACKOFF_MAX = 8
+# 落后分段的对冲下载：进度低于所有分段进度中位数的HEDGE_LAG_RATIO倍时，
+# 为剩余部分再发起一个相同的请求，先完成的那个生效
+HEDGE_ENABLED = True
+HEDGE_LAG_RATIO = 0.5
+HEDGE_MIN_ELAPSED = 3  # 分段开始下载多久后才考虑对冲（秒）
+HEDGE_MIN_BYTES = 256 * 1024  # 剩余数据少于这个值时不对冲
+HEDGE_MAX_ACTIVE = 4  # 同一文件同时进行的对冲请求上限
+
+DOWNLOAD_MIN_SEGMENT = 512 * 1024  # 每个分段至少这么大，小文件不必拆成32个请求
+
+def retry_delay(attempt):
+    """第attempt次重试前的等待时间（指数退避，带随机抖动）"""
+    delay = min(RETRY_BACKOFF * (2 ** (attempt - 1)), RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+# 磁盘写入配置
+DISK_BUFFER_SIZE = 256 * 1024  # 每个缓冲区的大小，填满后整块写入磁盘
+DISK_BUFFER_COUNT = 128  # 最多同时存在的缓冲区数量，限制内存占用
+DISK_WRITE_QUEUE = 64  # 等待写入的缓冲区上限，磁盘跟不上时下载线程会等待
+DISK_FSYNC = "complete"  # "none": 不主动同步；"complete": 分段完成时fsync；"always": 每次写入后fsync
+READ_CHUNK_MIN = 16 * 1024  # 每次从网络读取的最小字节数
+READ_CHUNK_TARGET_TIME = 0.05  # 根据速度调整每次读取的字节数，使一次读取大约耗时这么久（秒）
+
+class DiskWriteError(Exception):
+    """写入磁盘失败（例如磁盘已满），重试下载没有意义"""
+
+# 缓冲区池类
+class BufferPool:
+    """复用固定大小的bytearray，避免每次读取都分配新的bytes对象"""
+    
+    def __init__(self, size, count):
+        self.size = size
+        self.count = count
+        self.created = 0
+        self.free = queue.LifoQueue()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.count:
+                self.created += 1
+                return bytearray(self.size)
+        # 缓冲区都在使用中，等待写盘线程归还
+        return self.free.get()
+    
+    def release(self, buffer):
+        self.free.put(buffer)
+
+buffer_pool = BufferPool(DISK_BUFFER_SIZE, DISK_BUFFER_COUNT)
+
+# 写盘线程类
+class DiskWriter:
+    """所有下载线程共用一个写盘线程，下载线程只负责读网络，填满的缓冲区交给这里整块写入"""
+    
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=DISK_WRITE_QUEUE)
+        self.files = {}
+        self.errors = {}
+        self.thread = None
+        self.lock = threading.Lock()
+    
+    def write(self, path, offset, buffer, length):
+        """写入buffer的前length字节，写入完成后buffer归还给缓冲区池"""
+        error = self.errors.get(path)
+        if error:
+            buffer_pool.release(buffer)
+            raise DiskWriteError(f"写入文件失败: {error}")
+        self.submit(("write", path, offset, buffer, length))
+    
+    def close(self, path):
+        """等待path的所有写入完成并关闭文件"""
+        done = threading.Event()
+        self.submit(("close", path, done))
+        done.wait()
+        error = self.errors.pop(path, None)
+        if error:
+            raise DiskWriteError(f"写入文件失败: {error}")
+    
+    def submit(self, item):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.queue.put(item)
+    
+    def run(self):
+        while True:
+            op, path, *args = self.queue.get()
+            if op == "write":
+                offset, buffer, length = args
+                try:
+                    if path not in self.errors:
+                        f = self.files.get(path)
+                        if f is None:
+                            # 暂停后继续的分段接着已有的临时文件写，其他情况新建文件
+                            mode = "r+b" if offset and os.path.exists(path) else "wb"
+                            f = self.files[path] = open(path, mode)
+                        f.seek(offset)
+                        f.write(memoryview(buffer)[:length])
+                        if DISK_FSYNC == "always":
+                            f.flush()
+                            os.fsync(f.fileno())
+                except OSError as e:
+                    self.errors[path] = e
+                finally:
+                    buffer_pool.release(buffer)
+            else:
+                try:
+                    f = self.files.pop(path, None)
+                    if f is not None:
+                        with f:
+                            f.flush()
+                            if DISK_FSYNC != "none":
+                                os.fsync(f.fileno())
+                except OSError as e:
+                    self.errors[path] = e
+                finally:
+                    args[0].set()
+
+disk_writer = DiskWriter()
+
+# 运行指标（可选）：在本机HTTP端口上按Prometheus文本格式提供计数器和直方图，并定期写入滚动日志。
+# 关闭时记录函数直接返回；下载线程只在每次请求结束时记录一次，不在读取数据的循环中记录。
+METRICS_ENABLED = False
+METRICS_ADDRESS = "127.0.0.1"  # 只允许本机访问；集中采集时可改为"0.0.0.0"
+METRICS_PORT = 9464  # 访问 http://127.0.0.1:9464/metrics
+METRICS_LOG_FILE = os.path.join(STORE_DIR, "metrics.log")
+METRICS_LOG_INTERVAL = 60  # 写入日志的间隔（秒）
+METRICS_LOG_MAX_BYTES = 1024 * 1024  # 日志文件超过这个大小后轮换，保留3个旧文件
+METRICS_STALL_THRESHOLD = 0.1  # 界面定时器晚到超过这个时间（秒）记为一次卡顿
+
+class Metrics:
+    """进程内的计数器和直方图"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}  # 名称 -> (类型, 说明, 直方图的桶)
+        self.counters = {}  # (名称, 标签) -> 值
+        self.histograms = {}  # (名称, 标签) -> [各桶的次数, 总和, 次数]
+        self.server = None
+        self.logger = None
+    
+    def describe(self, name, kind, text, buckets=None):
+        self.kinds[name] = (kind, text, buckets)
+    
+    def inc(self, name, value=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        buckets = self.kinds[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def log(self, message):
+        if self.logger:
+            self.logger.info(message)
+    
+    def format_labels(self, labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in items) + "}"
+    
+    def render(self):
+        """按Prometheus文本格式（0.0.4）输出所有指标"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: [list(h[0]), h[1], h[2]] for key, h in self.histograms.items()}
+        lines = []
+        for name, (kind, text, buckets) in self.kinds.items():
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {value}")
+                continue
+            for (key_name, labels), (counts, total, count) in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self.format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self):
+        """日志用的摘要：计数器的值，直方图只记次数和总和"""
+        with self.lock:
+            data = {name + self.format_labels(labels): value for (name, labels), value in self.counters.items()}
+            for (name, labels), (_, total, count) in self.histograms.items():
+                data[name + "_count" + self.format_labels(labels)] = count
+                data[name + "_sum" + self.format_labels(labels)] = round(total, 3)
+        return data
+    
+    def start(self):
+        if self.server or not METRICS_ENABLED:
+            return
+        handler = logging.handlers.RotatingFileHandler(METRICS_LOG_FILE, maxBytes=METRICS_LOG_MAX_BYTES,
+                                                       backupCount=3, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        self.logger = logging.getLogger("nextppt.metrics")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(handler)
+        try:
+            self.server = http.server.ThreadingHTTPServer((METRICS_ADDRESS, METRICS_PORT), MetricsRequestHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        except OSError as e:
+            # 端口被占用时只写日志
+            print(f"启动指标服务失败: {e}")
+        threading.Thread(target=self.log_loop, daemon=True).start()
+    
+    def log_loop(self):
+        while True:
+            time.sleep(METRICS_LOG_INTERVAL)
+            self.log(json.dumps(self.snapshot(), ensure_ascii=False))
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+metrics = Metrics()
+DURATION_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+metrics.describe("nextppt_download_bytes_total", "counter", "下载的字节数，按来源（server/peer/bundle）")
+metrics.describe("nextppt_downloads_total", "counter", "结束的下载数，按结果（ok/error/cancelled）")
+metrics.describe("nextppt_download_duration_seconds", "histogram", "成功下载一个文件的耗时（不含暂停）", DURATION_BUCKETS)
+metrics.describe("nextppt_segment_retries_total", "counter", "分段请求出错后的重试次数")
+metrics.describe("nextppt_segment_errors_total", "counter", "重试用尽后失败的分段数")
+metrics.describe("nextppt_hedges_total", "counter", "为落后分段发起的对冲请求数")
+metrics.describe("nextppt_cache_lookups_total", "counter", "本地存储（store）和局域网节点（peer）的查找次数，按是否命中")
+metrics.describe("nextppt_catalog_fetches_total", "counter", "课件目录请求次数，按结果（changed/unchanged/error）")
+metrics.describe("nextppt_catalog_fetch_seconds", "histogram", "课件目录请求的耗时", LATENCY_BUCKETS)
+metrics.describe("nextppt_ui_stalls_total", "counter", "界面卡顿次数")
+metrics.describe("nextppt_ui_stall_seconds", "histogram", "界面卡顿的时长", LATENCY_BUCKETS)
+
 # 下载线程类
 class DownloadThread(QThread):
     progress_signal = pyqtSignal(int, int)  # 当前进度, 总大小
     complete_signal = pyqtSignal(str)  # 下载完成的文件路径
     error_signal = pyqtSignal(str)  # 错误信息
     
-    def __init__(self, url, save_path, start_byte, end_byte, thread_id):
+    def __init__(self, url, temp_file, start_byte, end_byte, thread_id, mirror=None, pool=None, resume_from=0):
         super().__init__()
+        # url为文件在服务器上的路径，每次请求时由镜像池拼出完整地址
         self.url = url
-        self.save_path = save_path
+        self.pool = pool or mirror_pool
+        self.mirror = mirror
         self.start_byte = start_byte
         self.end_byte = end_byte
         self.thread_id = thread_id
+        self.temp_file = temp_file
+        # 暂停后继续时，临时文件中已有resume_from字节，从之后的位置开始请求
+        self.downloaded = resume_from
+        # 正在填充的缓冲区及其中已有的字节数
+        self.buffer = None
+        self.buffer_fill = 0
+        self.chunk_size = 64 * 1024
+        self.started_at = None
+        self.response = None
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        """停止下载，正在阻塞的读取会因连接被关闭而立即返回"""
+        self.cancel_event.set()
+        response = self.response
+        if response is not None:
+            transport.abort(response)
         
     def run(self):
+        self.started_at = time.monotonic()
+        # 计算当前线程需要下载的总大小
+        total_size = self.end_byte - self.start_byte + 1
+        failures = 0
         try:
-            headers = {"Range": f"bytes={self.start_byte}-{self.end_byte}"}
-            response = requests.get(self.url, headers=headers, stream=True)
-            
-            # 计算当前线程需要下载的总大小
-            total_size = self.end_byte - self.start_byte + 1
-            downloaded = 0
+            # 数据写入临时文件，出错重试时从已收到的最后一个字节继续
+            try:
+                while self.downloaded < total_size:
+                    received = self.downloaded
+                    try:
+                        self.fetch_range(total_size)
+                    except DiskWriteError:
+                        raise
+                    except Exception as e:
+                        if self.cancel_event.is_set():
+                            return
+                        # 出错的镜像暂停使用，重试时换一个镜像
+                        self.pool.record_failure(self.mirror)
+                        self.mirror = self.pool.pick(exclude=self.mirror)
+                        # 本次请求收到过数据时重新计数，只有连续失败才会放弃
+                        failures = 1 if self.downloaded > received else failures + 1
+                        if failures > SEGMENT_RETRIES:
+                            metrics.inc("nextppt_segment_errors_total")
+                            raise
+                        metrics.inc("nextppt_segment_retries_total")
+                        print(f"分段{self.thread_id}下载出错，第{failures}次重试: {e}")
+                        if self.cancel_event.wait(retry_delay(failures)):
+                            return
+                    if self.cancel_event.is_set():
+                        return
+            finally:
+                # 交出最后一个缓冲区并等待写盘完成，之后才能合并临时文件
+                self.flush_buffer()
+                disk_writer.close(self.temp_file)
             
-            # 创建临时文件
-            temp_file = f"{self.save_path}.part{self.thread_id}"
-            with open(temp_file, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        self.progress_signal.emit(downloaded, total_size)
-            
-            self.complete_signal.emit(temp_file)
+            self.complete_signal.emit(self.temp_file)
         except Exception as e:
             self.error_signal.emit(str(e))
+    
+    def fetch_range(self, total_size):
+        if self.mirror is None:
+            self.mirror = self.pool.pick()
+        start = self.start_byte + self.downloaded
+        headers = {"Range": f"bytes={start}-{self.end_byte}"}
+        requested_at = time.monotonic()
+        self.response = transport.request("GET", self.pool.url(self.mirror, self.url), headers=headers,
+                                          stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+        with self.response as response:
+            response.raise_for_status()
+            # 按收到响应头的时间和实际传输速度给镜像评分
+            received_at = time.monotonic()
+            self.pool.record_latency(self.mirror, received_at - requested_at)
+            try:
+                self.receive(response, start, total_size)
+            finally:
+                received = self.start_byte + self.downloaded - start
+                self.pool.record_throughput(self.mirror, received, time.monotonic() - received_at)
+                source = "peer" if isinstance(self.pool, PeerPool) and self.mirror in self.pool.mirrors else "server"
+                metrics.inc("nextppt_download_bytes_total", received, source=source)
+        if self.downloaded < total_size and not self.cancel_event.is_set():
+            raise IOError("连接提前断开")
+    
+    def receive(self, response, start, total_size):
+        # 服务器忽略Range返回整个文件时，只有从0开始的分段能直接使用
+        if response.status_code != 206 and start != 0:
+            raise IOError("服务器不支持分段下载")
+        while self.downloaded < total_size:
+            if self.cancel_event.is_set():
+                return
+            if self.buffer is None:
+                self.buffer = buffer_pool.acquire()
+                self.buffer_fill = 0
+            # 直接读入缓冲区，不为每次读取分配新对象
+            n = min(self.chunk_size, len(self.buffer) - self.buffer_fill, total_size - self.downloaded)
+            read_at = time.monotonic()
+            n = response.raw.readinto(memoryview(self.buffer)[self.buffer_fill:self.buffer_fill + n])
+            if not n:
+                return
+            self.adapt_chunk_size(n, time.monotonic() - read_at)
+            self.buffer_fill += n
+            self.downloaded += n
+            self.progress_signal.emit(self.downloaded, total_size)
+            if self.buffer_fill == len(self.buffer):
+                self.flush_buffer()
+        # 正常的206响应读到结尾，连接才能放回连接池复用
+        if response.status_code == 206:
+            response.raw.readinto(bytearray(1))
+    
+    def adapt_chunk_size(self, n, elapsed):
+        # 速度快时加大每次读取的字节数，速度慢时减小，让进度和对冲检查仍能及时更新
+        target = n / elapsed * READ_CHUNK_TARGET_TIME if elapsed > 0 else self.chunk_size * 2
+        if target > self.chunk_size * 2:
+            self.chunk_size = min(self.chunk_size * 2, DISK_BUFFER_SIZE)
+        elif target < self.chunk_size / 2:
+            self.chunk_size = max(self.chunk_size // 2, READ_CHUNK_MIN)
+    
+    def flush_buffer(self):
+        # 把缓冲区交给写盘线程，写入位置是缓冲区第一个字节在分段中的偏移
+        buffer, self.buffer = self.buffer, None
+        if buffer is None:
+            return
+        if self.buffer_fill:
+            disk_writer.write(self.temp_file, self.downloaded - self.buffer_fill, buffer, self.buffer_fill)
+        else:
+            buffer_pool.release(buffer)
 
 # 下载管理器类
 class DownloadManager(QThread):
     progress_signal = pyqtSignal(int, int)  # 当前进度, 总大小
     complete_signal = pyqtSignal(str)  # 下载完成的文件路径
     error_signal = pyqtSignal(str)  # 错误信息
+    threads_started = pyqtSignal()  # 分段线程已启动（用于在主线程中启动对冲检查）
+    cancelled_signal = pyqtSignal()  # 下载已取消
     
-    def __init__(self, url, save_path, material_id, material_title):
+    def __init__(self, url, save_path, material_id, material_title, content_hash=None, revision=None):
         super().__init__()
         self.url = url
         self.save_path = save_path
+        # 分段临时文件的路径前缀，每次下载不同，同名文件同时下载时不会互相覆盖
+        self.part_prefix = os.path.join(content_store.tmp_dir, uuid.uuid4().hex)
         self.material_id = material_id
         self.material_title = material_title
+        # 服务器提供的内容哈希（可选），用于在下载前判断本地是否已有相同内容
+        self.content_hash = content_hash
+        # 文件版本（上传日期），服务器不提供哈希时用来判断本地内容是否过期
+        self.revision = revision
         self.threads = []
-        self.completed_parts = []
+        # 每个远程区间的下载状态，见start_threads
+        self.segments = []
         self.total_size = 0
         self.downloaded = 0
+        self.failed = False
+        # 暂停时断开所有连接但保留临时文件；取消时还会删除临时文件
+        self.paused = False
+        self.cancelled = False
+        self.completed = False
+        # 定时检查落后的分段并发起对冲请求
+        self.hedge_timer = QTimer(self)
+        self.hedge_timer.setInterval(1000)
+        self.hedge_timer.timeout.connect(self.check_stragglers)
+        self.threads_started.connect(self.hedge_timer.start)
+        # 拼装计划，见build_delta_plan；增量更新时base_path为本地旧文件
+        self.plan = []
+        self.base_path = None
+        self.expected_hash = None
+        # 同一URL上一次下载的内容（旧版本）
+        self.previous_path = None
+        # 分段的下载来源：服务器镜像池，或优先使用局域网节点的PeerPool
+        self.sources = mirror_pool
+        # 记录下载耗时（不含暂停的时间）和结果
+        self.started_at = None
+        self.paused_at = None
+        self.paused_time = 0
+        self.complete_signal.connect(lambda path: self.record_result("ok"))
+        self.error_signal.connect(lambda error: self.record_result("error", error))
+        self.cancelled_signal.connect(lambda: self.record_result("cancelled"))
         
     def run(self):
+        self.started_at = time.monotonic()
         try:
+            # 本地存储中已有相同内容时直接完成，不访问网络
+            digest = content_store.lookup(self.url, self.content_hash, self.revision)
+            metrics.inc("nextppt_cache_lookups_total", cache="store", result="hit" if digest else "miss")
+            if digest:
+                self.finish(digest)
+                return
+            self.previous_path = content_store.previous(self.url)
+            
             # 获取文件大小
-            response = requests.head(self.url)
+            for attempt in range(SEGMENT_RETRIES + 1):
+                try:
+                    response = mirror_pool.request("HEAD", self.url,
+                                                   timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+                    break
+                except requests.RequestException:
+                    if attempt == SEGMENT_RETRIES or self.cancelled:
+                        raise
+                    time.sleep(retry_delay(attempt + 1))
+            if self.cancelled:
+                return
             self.total_size = int(response.headers.get("Content-Length", 0))
             
             if self.total_size == 0:
                 self.error_signal.emit("无法获取文件大小")
                 return
             
-            # 计算每个线程下载的大小
-            part_size = self.total_size // DOWNLOAD_THREADS
+            # 先腾出空间，避免下载到一半磁盘写满；分段文件合并时约占两倍文件大小
+            make_room(self.total_size, 2 * self.total_size,
+                      keep=[os.path.basename(self.previous_path)] if self.previous_path else [])
             
-            # 创建并启动下载线程
-            for i in range(DOWNLOAD_THREADS):
-                start_byte = i * part_size
-                end_byte = (i + 1) * part_size - 1 if i < DOWNLOAD_THREADS - 1 else self.total_size - 1
-                
-                thread = DownloadThread(self.url, self.save_path, start_byte, end_byte, i)
-                thread.progress_signal.connect(self.update_progress)
-                thread.complete_signal.connect(self.part_completed)
-                thread.error_signal.connect(self.thread_error)
-                
-                self.threads.append(thread)
-                thread.start()
+            # 已知内容哈希时，优先从局域网中已有该文件的节点下载
+            if PEER_CACHE_ENABLED and self.content_hash:
+                peers = peer_cache.find(self.content_hash, self.total_size)
+                metrics.inc("nextppt_cache_lookups_total", cache="peer", result="hit" if peers else "miss")
+                if peers:
+                    self.sources = PeerPool(peers, self.content_hash)
+            
+            # 本地有旧版本时尝试只下载变化的部分
+            if DELTA_UPDATES and self.start_delta_download():
+                return
+            self.start_full_download()
         except Exception as e:
-            self.error_signal.emit(str(e))
+            if not self.cancelled:
+                self.error_signal.emit(str(e))
+    
+    def start_full_download(self):
+        # 计算每个线程下载的大小，小文件用较少的分段
+        count = max(1, min(DOWNLOAD_THREADS, self.total_size // DOWNLOAD_MIN_SEGMENT))
+        part_size = self.total_size // count
+        
+        self.plan = []
+        for i in range(count):
+            start_byte = i * part_size
+            end_byte = (i + 1) * part_size - 1 if i < count - 1 else self.total_size - 1
+            self.plan.append(("remote", start_byte, end_byte))
+        self.base_path = None
+        self.expected_hash = self.content_hash
+        self.start_threads()
+    
+    def start_delta_download(self):
+        """本地存在旧版本且服务器提供分块签名时，只下载变化的字节区间"""
+        base_path = self.previous_path
+        if not base_path:
+            return False
+        try:
+            response = mirror_pool.request("GET", f"{self.url}{DELTA_SIGNATURE_SUFFIX}",
+                                           timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+            if response.status_code != 200:
+                return False
+            signature = response.json()
+            if signature["size"] != self.total_size:
+                return False
+            plan = build_delta_plan(base_path, signature, DOWNLOAD_THREADS, DELTA_SEARCH_WINDOW)
+        except Exception as e:
+            print(f"增量更新不可用，改为完整下载: {e}")
+            return False
+        
+        remote_bytes = sum(item[2] - item[1] + 1 for item in plan if item[0] == "remote")
+        if remote_bytes > self.total_size * DELTA_MAX_RATIO:
+            return False
+        
+        self.plan = plan
+        self.base_path = base_path
+        self.expected_hash = signature["sha256"]
+        if remote_bytes == 0:
+            # 所有块都能从本地旧文件中找到，直接拼装
+            self.merge_parts()
+        else:
+            self.start_threads()
+        return True
+    
+    def start_threads(self):
+        # 为拼装计划中的每个远程区间创建并启动下载线程
+        if self.cancelled:
+            return
+        self.threads = []
+        self.segments = []
+        remote = [item for item in self.plan if item[0] == "remote"]
+        for i, (_, start_byte, end_byte) in enumerate(remote):
+            thread = self.create_thread(start_byte, end_byte, i)
+            # thread: 主请求，hedge: 对冲请求，progress: 分段已下载的字节数，
+            # files: 完成后按顺序拼接的 (临时文件, 使用的长度)
+            self.segments.append({"start": start_byte, "end": end_byte, "thread": thread,
+                                  "hedge": None, "progress": 0, "done": False, "files": []})
+        if self.paused:
+            # 获取文件信息时已被暂停，继续时再启动
+            return
+        for segment in self.segments:
+            segment["thread"].start()
+        self.threads_started.emit()
+    
+    def create_thread(self, start_byte, end_byte, index, temp_file=None, mirror=None, resume_from=0):
+        # 每个分段按镜像速度加权选择镜像，同一文件的分段同时从多个镜像下载
+        thread = DownloadThread(self.url, temp_file or f"{self.part_prefix}.part{index}", start_byte, end_byte, index,
+                                mirror or self.sources.pick(), self.sources, resume_from)
+        thread.progress_signal.connect(self.update_progress)
+        thread.complete_signal.connect(self.part_completed)
+        thread.error_signal.connect(self.thread_error)
+        self.threads.append(thread)
+        return thread
     
     def update_progress(self, part_progress, part_total):
-        # 这里不应该累加part_progress，因为part_progress是当前已下载的总量，而不是增量
-        # 修改为直接发送当前线程的进度，让DownloadDialog处理总进度的计算
-        self.progress_signal.emit(part_progress, part_total)
+        # 记录分段进度，对冲请求从主请求停下的位置开始，两者取较快的一个
+        thread = self.sender()
+        segment = self.segments[thread.thread_id]
+        offset = thread.start_byte - segment["start"]
+        segment["progress"] = max(segment["progress"], offset + part_progress)
+        
+        # 发送整个文件的进度
+        total = sum(s["end"] - s["start"] + 1 for s in self.segments)
+        self.progress_signal.emit(sum(s["progress"] for s in self.segments), total)
+    
+    def check_stragglers(self):
+        """为进度明显落后的分段发起对冲请求"""
+        pending = [s for s in self.segments if not s["done"]]
+        if self.paused or self.cancelled:
+            self.hedge_timer.stop()
+            return
+        if not HEDGE_ENABLED or not pending or self.failed:
+            if not pending or self.failed:
+                self.hedge_timer.stop()
+            return
+        fractions = sorted(s["progress"] / (s["end"] - s["start"] + 1) for s in self.segments)
+        median = fractions[len(fractions) // 2]
+        active = sum(1 for s in pending if s["hedge"])
+        now = time.monotonic()
+        for segment in pending:
+            if active >= HEDGE_MAX_ACTIVE:
+                break
+            thread = segment["thread"]
+            size = segment["end"] - segment["start"] + 1
+            if (segment["hedge"] or thread.started_at is None
+                    or now - thread.started_at < HEDGE_MIN_ELAPSED
+                    or size - segment["progress"] < HEDGE_MIN_BYTES
+                    or segment["progress"] / size >= median * HEDGE_LAG_RATIO):
+                continue
+            index = thread.thread_id
+            # 对冲请求尽量发往另一个镜像
+            hedge = self.create_thread(segment["start"] + segment["progress"], segment["end"],
+                                       index, f"{thread.temp_file}.hedge",
+                                       self.sources.pick(exclude=thread.mirror))
+            segment["hedge"] = hedge
+            hedge.start()
+            metrics.inc("nextppt_hedges_total")
+            active += 1
     
     def part_completed(self, temp_file):
-        self.completed_parts.append(temp_file)
+        thread = self.sender()
+        segment = self.segments[thread.thread_id]
+        if segment["done"] or self.cancelled:
+            return
+        segment["done"] = True
+        
+        # 主请求与对冲请求先完成的生效，另一个立即停止
+        primary, hedge = segment["thread"], segment["hedge"]
+        # files中可能已有暂停前从对冲请求继续时留下的前半段
+        if thread is hedge:
+            primary.cancel()
+            primary.wait()
+            segment["files"] += [(primary.temp_file, hedge.start_byte - primary.start_byte),
+                                 (hedge.temp_file, None)]
+        else:
+            segment["files"] += [(primary.temp_file, None)]
+            if hedge:
+                hedge.cancel()
+                hedge.wait()
+                self.remove_file(hedge.temp_file)
         
         # 检查是否所有部分都已下载完成
-        if len(self.completed_parts) == DOWNLOAD_THREADS:
+        if all(s["done"] for s in self.segments):
+            self.hedge_timer.stop()
             self.merge_parts()
     
     def thread_error(self, error):
+        # 主请求和对冲请求中还有一个在下载时，不算失败
+        thread = self.sender()
+        segment = self.segments[thread.thread_id]
+        twin = segment["hedge"] if thread is segment["thread"] else segment["thread"]
+        if segment["done"] or self.failed or self.cancelled or (twin and twin.isRunning()):
+            return
+        self.failed = True
+        self.hedge_timer.stop()
+        for t in self.threads:
+            t.cancel()
         self.error_signal.emit(error)
     
+    def pause(self):
+        """暂停下载：立即断开所有连接，已下载的数据留在临时文件中"""
+        if self.paused or self.cancelled or self.completed or self.failed:
+            return
+        self.paused = True
+        self.paused_at = time.monotonic()
+        self.hedge_timer.stop()
+        for thread in self.threads:
+            thread.cancel()
+    
+    def resume(self):
+        """从暂停的位置继续，每个分段从临时文件中已有的数据之后开始请求"""
+        if not self.paused or self.cancelled:
+            return
+        self.paused = False
+        self.paused_time += time.monotonic() - self.paused_at
+        pending = [segment for segment in self.segments if not segment["done"]]
+        for segment in pending:
+            self.resume_segment(segment)
+        for segment in pending:
+            segment["thread"].start()
+        if pending:
+            self.hedge_timer.start()
+    
+    def resume_segment(self, segment):
+        # 等旧线程写完磁盘，以临时文件中实际写入的字节数为准
+        primary, hedge = segment["thread"], segment["hedge"]
+        primary.wait()
+        base, length = primary, self.written_bytes(primary)
+        if hedge:
+            hedge.wait()
+            hedge_offset = hedge.start_byte - primary.start_byte
+            hedge_length = self.written_bytes(hedge)
+            if hedge_offset + hedge_length > length:
+                # 对冲请求下载得更多：主请求的文件只用到对冲开始的位置，之后接着对冲请求的文件下载
+                segment["files"].append((primary.temp_file, hedge_offset))
+                base, length = hedge, hedge_length
+            else:
+                self.remove_file(hedge.temp_file)
+        segment["thread"] = self.create_thread(base.start_byte, base.end_byte, base.thread_id,
+                                               base.temp_file, base.mirror, length)
+        segment["hedge"] = None
+    
+    def written_bytes(self, thread):
+        try:
+            return min(thread.downloaded, os.path.getsize(thread.temp_file))
+        except OSError:
+            return 0
+    
+    def cancel(self):
+        """取消下载：立即断开所有连接，线程退出后在后台删除临时文件"""
+        if self.cancelled or self.completed:
+            return
+        self.cancelled = True
+        self.hedge_timer.stop()
+        for thread in self.threads:
+            thread.cancel()
+        self.cancelled_signal.emit()
+        # 不设为守护线程，程序退出前也会删完临时文件
+        threading.Thread(target=self.remove_parts).start()
+    
+    def remove_parts(self):
+        self.wait()
+        for thread in list(self.threads):
+            thread.wait()
+        for thread in self.threads:
+            self.remove_file(thread.temp_file)
+    
+    def remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def record_result(self, result, error=None):
+        metrics.inc("nextppt_downloads_total", result=result)
+        # 只统计实际访问了网络的下载（本地存储命中时没有文件大小）
+        if result == "ok" and self.total_size:
+            metrics.observe("nextppt_download_duration_seconds",
+                            time.monotonic() - self.started_at - self.paused_time)
+        if error:
+            metrics.log(f"下载失败 {self.url}: {error}")
+    
     def merge_parts(self):
+        if self.cancelled:
+            return
         try:
-            # 按照线程ID排序
-            self.completed_parts.sort(key=lambda x: int(x.split("part")[1]))
-            
-            # 合并文件
-            with open(self.save_path, "wb") as outfile:
-                for part in self.completed_parts:
-                    with open(part, "rb") as infile:
-                        outfile.write(infile.read())
+            # 按拼装计划合并文件到存储的临时目录，同时计算内容哈希
+            sha256 = hashlib.sha256()
+            temp_path = content_store.new_temp_path()
+            segments = iter(self.segments)
+            base = open(self.base_path, "rb") if self.base_path else None
+            try:
+                with open(temp_path, "wb") as outfile:
+                    for item in self.plan:
+                        if item[0] == "local":
+                            base.seek(item[1])
+                            self.copy_blocks(base, outfile, sha256, item[2])
+                            continue
+                        for part, length in next(segments)["files"]:
+                            with open(part, "rb") as infile:
+                                self.copy_blocks(infile, outfile, sha256, length)
+            finally:
+                if base:
+                    base.close()
             
             # 删除临时文件
-            for part in self.completed_parts:
-                os.remove(part)
+            for segment in self.segments:
+                for part, _ in segment["files"]:
+                    self.remove_file(part)
             
-            # 更新下载记录
-            self.update_download_record()
+            digest = sha256.hexdigest()
+            if self.expected_hash and digest != self.expected_hash:
+                os.remove(temp_path)
+                if not self.base_path and self.sources is mirror_pool:
+                    self.error_signal.emit("文件校验失败")
+                    return
+                # 增量拼装或局域网节点提供的内容不正确，改为只从服务器完整下载
+                print("下载内容校验失败，改为从服务器完整下载")
+                self.sources = mirror_pool
+                self.start_full_download()
+                return
             
-            # 发送完成信号
-            self.complete_signal.emit(self.save_path)
+            content_store.commit(temp_path, digest, self.url, self.revision)
+            self.finish(digest)
         except Exception as e:
             self.error_signal.emit(str(e))
     
-    def update_download_record(self):
+    def copy_blocks(self, infile, outfile, sha256, length=None):
+        # 分块复制length字节（None表示到文件末尾），同时更新哈希
+        while length is None or length > 0:
+            block = infile.read(1024 * 1024 if length is None else min(1024 * 1024, length))
+            if not block:
+                break
+            if length is not None:
+                length -= len(block)
+            sha256.update(block)
+            outfile.write(block)
+    
+    def finish(self, digest):
+        self.completed = True
+        # 在下载目录中生成用户可见的文件（硬链接到存储对象）
+        self.save_path = content_store.materialize(digest, os.path.basename(self.save_path),
+                                                   self.previous_path)
+        
+        # 更新下载记录
+        self.update_download_record(digest)
+        
+        # 发送完成信号
+        self.complete_signal.emit(self.save_path)
+    
+    def update_download_record(self, digest):
+        add_download_records([{
+            "id": self.material_id,
+            "title": self.material_title,
+            "path": self.save_path,
+            "hash": digest,
+            "date": self.get_current_date()
+        }])
+    
+    def get_current_date(self):
+        from datetime import datetime
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+download_record_lock = threading.Lock()
+
+def migrate_download_records():
+    """课件ID统一保存为字符串：旧版本的下载记录中可能是数字，转换后同一课件只保留最后一条"""
+    with download_record_lock:
+        try:
+            with open(DOWNLOAD_RECORD_FILE, "r", encoding="utf-8") as f:
+                records = json.load(f)
+            if all(isinstance(record.get("id"), str) for record in records):
+                return
+            latest = {}
+            for record in records:
+                record["id"] = str(record.get("id"))
+                previous = latest.pop(record["id"], {})
+                record.setdefault("pinned", previous.get("pinned", False))
+                latest[record["id"]] = record
+            with open(DOWNLOAD_RECORD_FILE, "w", encoding="utf-8") as f:
+                json.dump(list(latest.values()), f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"转换下载记录失败: {e}")
+
+def add_download_records(entries):
+    """把下载完成的课件写入下载记录，同一课件只保留最新的一条"""
+    with download_record_lock:
         try:
             # 读取现有记录
             with open(DOWNLOAD_RECORD_FILE, "r", encoding="utf-8") as f:
                 records = json.load(f)
             
-            # 添加新记录
-            records.append({
-                "id": self.material_id,
-                "title": self.material_title,
-                "path": self.save_path,
-                "date": self.get_current_date()
-            })
+            # 添加新记录，重新下载时保留固定状态，下载完成算作一次打开
+            old = {record["id"]: record for record in records}
+            for entry in entries:
+                entry["id"] = str(entry["id"])
+                entry.setdefault("accessed", time.time())
+                entry.setdefault("pinned", old.get(entry["id"], {}).get("pinned", False))
+            ids = {entry["id"] for entry in entries}
+            records = [record for record in records if record["id"] not in ids] + entries
             
             # 保存记录
             with open(DOWNLOAD_RECORD_FILE, "w", encoding="utf-8") as f:
                 json.dump(records, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"更新下载记录失败: {e}")
+
+def update_record_fields(material_id, **fields):
+    """修改一条下载记录（打开时间、是否固定）"""
+    with download_record_lock:
+        try:
+            with open(DOWNLOAD_RECORD_FILE, "r", encoding="utf-8") as f:
+                records = json.load(f)
+            for record in records:
+                if record["id"] == str(material_id):
+                    record.update(fields)
+            with open(DOWNLOAD_RECORD_FILE, "w", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"更新下载记录失败: {e}")
+
+# 下载目录容量管理：下载前检查配额和磁盘剩余空间，不够时先删除不再被引用的旧版本；
+# 设置了配额时再按最近打开时间删除最久没用的课件，没有设置配额时不会删除用户的课件。
+# 占用空间按存储索引中的对象大小计算，打开时间记在下载记录中，都不需要扫描目录。
+DISK_QUOTA = 0  # 下载目录的容量上限（字节），0表示不限制，例如 20 * 1024 ** 3 表示20GB
+DISK_RESERVE = 512 * 1024 * 1024  # 磁盘上至少保留的剩余空间（字节）
+
+class DiskQuotaError(Exception):
+    """腾不出足够的空间"""
+
+# 跨线程通知界面（在主线程中创建，信号在主线程处理）
+class DownloadEvents(QObject):
+    evicted_signal = pyqtSignal(object)  # 被清理的课件ID列表
+
+download_events = DownloadEvents()
+
+def record_accessed(record):
+    """下载记录中最近一次打开的时间，旧记录没有这个字段时用下载日期"""
+    if "accessed" in record:
+        return record["accessed"]
+    try:
+        return datetime.strptime(record["date"], "%Y-%m-%d %H:%M:%S").timestamp()
+    except (KeyError, ValueError):
+        return 0
+
+def make_room(size, peak=None, keep=()):
+    """为即将下载的size字节腾出空间
+
+    peak为下载过程中临时文件的最大占用（分段下载合并时约为两倍文件大小）。
+    先删除不再被下载记录引用的旧版本；设置了DISK_QUOTA时再按最近打开时间从旧到新
+    删除未固定的课件，keep中的对象（例如增量更新的基准）不删除。空间仍然不够时抛出DiskQuotaError。
+    """
+    peak = size if peak is None else peak
+    if DISK_QUOTA and size > DISK_QUOTA:
+        raise DiskQuotaError("文件大小超过下载目录的容量上限")
     
-    def get_current_date(self):
-        from datetime import datetime
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def enough(used):
+        free = shutil.disk_usage(DOWNLOAD_DIR).free
+        return (not DISK_QUOTA or used + size <= DISK_QUOTA) and free >= peak + DISK_RESERVE
+    
+    objects = content_store.usage()
+    used = sum(objects.values())
+    if enough(used):
+        return []
+    
+    with download_record_lock:
+        with open(DOWNLOAD_RECORD_FILE, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        # 每个对象最近一次被打开的时间；没有记录引用的对象（旧版本或刚下载完还没写记录的）按下载时间算
+        accessed = {}
+        for digest in objects:
+            try:
+                accessed[digest] = os.path.getmtime(content_store.object_path(digest))
+            except OSError:
+                accessed[digest] = 0
+        protected = set(keep)
+        referenced = {}
+        for record in records:
+            digest = record.get("hash")
+            if digest not in objects:
+                continue
+            if record.get("pinned"):
+                protected.add(digest)
+            referenced[digest] = max(referenced.get(digest, 0), record_accessed(record))
+        accessed.update(referenced)
+        if not DISK_QUOTA:
+            # 没有设置配额时只是磁盘快满了，不替用户删除课件
+            protected.update(referenced)
+        
+        evicted_records = []
+        for digest in sorted((d for d in objects if d not in protected), key=accessed.get):
+            if enough(used):
+                break
+            for record in records:
+                if record.get("hash") == digest:
+                    try:
+                        os.remove(record["path"])
+                    except OSError:
+                        pass
+                    evicted_records.append(record)
+            content_store.remove(digest)
+            used -= objects[digest]
+        
+        if evicted_records:
+            records = [record for record in records if record not in evicted_records]
+            with open(DOWNLOAD_RECORD_FILE, "w", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False, indent=2)
+    
+    evicted = [record["id"] for record in evicted_records]
+    if evicted:
+        print(f"空间不足，已清理{len(evicted)}个最久没有打开的课件")
+        download_events.evicted_signal.emit(evicted)
+    if not enough(used):
+        if DISK_QUOTA:
+            raise DiskQuotaError("下载目录空间不足，请取消固定一些课件或调大容量上限")
+        raise DiskQuotaError("磁盘剩余空间不足，请清理磁盘或删除一些已下载的课件")
+    return evicted
+
+# 打包下载：一次请求多个课件，服务器把它们依次写进一个tar流，客户端边接收边解包，
+# 成员名为"课件ID/文件名"。服务器没有这个接口时改为逐个文件并行下载。
+BUNDLE_ENABLED = True
+BUNDLE_PATH = "/api/materials/bundle"  # POST {"ids": [课件ID, ...]}，返回 application/x-tar
+BUNDLE_MAX_FILE_SIZE = 16 * 1024 * 1024  # 超过这个大小的课件不打包，仍然分段并行下载
+BUNDLE_PARALLEL_FILES = 4  # 逐个下载时同时下载的文件数
+
+class BundleUnavailable(Exception):
+    """服务器不支持打包下载"""
+
+# 打包下载管理器：打包流在线程中接收，逐个下载的部分在主线程中调度DownloadManager
+class BundleDownloadManager(QThread):
+    progress_signal = pyqtSignal(int, int)  # 当前进度, 总大小
+    item_signal = pyqtSignal(object, str)  # 下载完成的课件ID, 文件路径
+    complete_signal = pyqtSignal()  # 全部完成
+    error_signal = pyqtSignal(str)  # 错误信息
+    cancelled_signal = pyqtSignal()  # 下载已取消
+    fallback_signal = pyqtSignal(object)  # 需要逐个下载的课件
+    
+    def __init__(self, materials):
+        super().__init__()
+        self.materials = materials
+        self.total_size = sum(material.file_size for material in materials)
+        # 已完成课件的字节数，逐个下载中的进度另外记录
+        self.received = 0
+        self.done = set()
+        self.records = []
+        self.response = None
+        # 打包下载不能暂停，DownloadDialog会查询这个属性
+        self.paused = False
+        self.cancelled = False
+        # 逐个下载：等待中的课件和正在下载的 课件ID -> [DownloadManager, 已下载字节数]
+        self.queue = []
+        self.managers = {}
+        self.errors = []
+        self.fallback_signal.connect(self.start_fallback)
+    
+    def run(self):
+        try:
+            pending = []
+            for material in self.materials:
+                # 本地存储中已有相同内容时直接完成
+                digest = content_store.lookup(material.file_url, material.hash, material.upload_date)
+                metrics.inc("nextppt_cache_lookups_total", cache="store", result="hit" if digest else "miss")
+                if digest:
+                    self.finish_item(material, digest)
+                else:
+                    pending.append(material)
+            
+            small = [m for m in pending if m.file_size <= BUNDLE_MAX_FILE_SIZE]
+            if BUNDLE_ENABLED and len(small) > 1:
+                # 打包流直接写入存储，只需要文件本身的空间；单独下载的课件各自检查
+                make_room(sum(m.file_size for m in small))
+                try:
+                    self.stream_bundle(small)
+                except BundleUnavailable:
+                    print("服务器不支持打包下载，改为逐个下载")
+                except Exception as e:
+                    if not self.cancelled:
+                        print(f"打包下载中断，剩余课件改为逐个下载: {e}")
+        except Exception as e:
+            if not self.cancelled:
+                self.error_signal.emit(str(e))
+            return
+        finally:
+            if self.records:
+                add_download_records(self.records)
+        if not self.cancelled:
+            self.fallback_signal.emit([m for m in pending if m.id not in self.done])
+    
+    def stream_bundle(self, materials):
+        by_id = {material.id: material for material in materials}
+        # 不接受gzip等压缩，tar流直接按字节解包（课件本身已经是压缩格式）
+        response = mirror_pool.request("POST", BUNDLE_PATH, json={"ids": [m.id for m in materials]},
+                                       headers={"Accept-Encoding": "identity"}, stream=True,
+                                       timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+        self.response = response
+        with response:
+            if self.cancelled:
+                return
+            if response.status_code in (404, 405, 501):
+                raise BundleUnavailable()
+            response.raise_for_status()
+            with tarfile.open(fileobj=response.raw, mode="r|") as archive:
+                for member in archive:
+                    if self.cancelled:
+                        return
+                    # 只按成员名中的课件ID对应课件，文件名用课件自己的，不使用压缩包里的路径
+                    material = by_id.get(member.name.split("/", 1)[0])
+                    if member.isfile() and material and material.id not in self.done:
+                        self.receive_member(archive.extractfile(member), material)
+    
+    def receive_member(self, member, material):
+        # 直接写入存储的临时文件并计算哈希，不在下载目录中留下半个文件
+        previous = content_store.previous(material.file_url)
+        temp_path = content_store.new_temp_path()
+        sha256 = hashlib.sha256()
+        received = 0
+        try:
+            with open(temp_path, "wb") as f:
+                while True:
+                    block = member.read(1024 * 1024)
+                    if not block:
+                        break
+                    sha256.update(block)
+                    f.write(block)
+                    received += len(block)
+                    self.progress_signal.emit(self.received + received, self.total_size)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        finally:
+            metrics.inc("nextppt_download_bytes_total", received, source="bundle")
+        
+        digest = sha256.hexdigest()
+        if material.hash and digest != material.hash:
+            # 这个课件之后单独下载
+            print(f"打包下载的课件校验失败: {material.title}")
+            os.remove(temp_path)
+            return
+        content_store.commit(temp_path, digest, material.file_url, material.upload_date)
+        self.finish_item(material, digest, previous)
+        self.received += received
+    
+    def finish_item(self, material, digest, previous=None):
+        path = content_store.materialize(digest, os.path.basename(material.file_url), previous)
+        self.done.add(material.id)
+        self.records.append({
+            "id": material.id,
+            "title": material.title,
+            "path": path,
+            "hash": digest,
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        self.item_signal.emit(material.id, path)
+    
+    def start_fallback(self, materials):
+        self.queue = list(materials)
+        self.start_next()
+    
+    def start_next(self):
+        while self.queue and len(self.managers) < BUNDLE_PARALLEL_FILES and not self.cancelled:
+            material = self.queue.pop(0)
+            manager = DownloadManager(material.file_url, os.path.join(DOWNLOAD_DIR, os.path.basename(material.file_url)),
+                                      material.id, material.title,
+                                      material.hash, material.upload_date)
+            self.managers[material.id] = [manager, 0]
+            manager.progress_signal.connect(lambda current, total, material=material: self.file_progress(material, current))
+            manager.complete_signal.connect(lambda path, material=material: self.file_completed(material, path))
+            manager.error_signal.connect(lambda error, material=material: self.file_failed(material, error))
+            manager.start()
+        if not self.managers and not self.cancelled:
+            if self.errors:
+                self.error_signal.emit("\n".join(self.errors))
+            else:
+                self.complete_signal.emit()
+    
+    def file_progress(self, material, current):
+        if material.id in self.managers:
+            self.managers[material.id][1] = current
+            self.progress_signal.emit(self.received + sum(progress for _, progress in self.managers.values()),
+                                      self.total_size)
+    
+    def file_completed(self, material, path):
+        if self.managers.pop(material.id, None) is None:
+            return
+        self.received += material.file_size
+        self.done.add(material.id)
+        self.item_signal.emit(material.id, path)
+        self.start_next()
+    
+    def file_failed(self, material, error):
+        if self.managers.pop(material.id, None) is None:
+            return
+        self.errors.append(f"{material.title}: {error}")
+        self.start_next()
+    
+    def cancel(self):
+        """取消下载：中止打包流和所有逐个下载"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.queue = []
+        if self.response is not None:
+            transport.abort(self.response)
+        for manager, _ in self.managers.values():
+            manager.cancel()
+        self.managers.clear()
+        self.cancelled_signal.emit()
+
+# 课件目录同步配置
+# GET /api/materials?since=<版本> 支持增量时返回
+#   {"version": 版本, "added": [...], "updated": [...], "deleted": [课件ID, ...]}
+# 或完整列表 {"version": 版本, "full": true, "materials": [...]}；
+# 旧版服务器忽略since直接返回课件数组，客户端按完整列表处理。
+# 响应带ETag时，目录没有变化的轮询只会收到304。
+CATALOG_POLL_INTERVAL = 60  # 轮询间隔（秒），0表示不轮询
+# 服务器既不返回version也不返回ETag时，每次轮询都会下载完整目录，改用这个间隔（秒），0表示不轮询
+CATALOG_FULL_POLL_INTERVAL = 30 * 60
+# 可选的服务器推送（Server-Sent Events），每条data为一次增量，格式同上
+CATALOG_EVENTS_ENABLED = False
+CATALOG_EVENTS_PATH = "/api/materials/events"
+
+# 课件目录的内存表示：服务器返回的JSON在一次遍历中校验并转换为紧凑的Material记录。
+# 科目和上传日期的取值很少，驻留后所有课件共用同一个字符串；目录按科目分组，切换分类不再遍历全部课件。
+class Material:
+    """一个课件（创建后不修改，目录更新时整体替换）"""
+    __slots__ = ("id", "title", "category", "description", "file_url", "file_size", "upload_date", "hash")
+    
+    def __init__(self, id, title, category, description, file_url, file_size, upload_date, hash):
+        self.id = id
+        self.title = title
+        self.category = category
+        self.description = description
+        self.file_url = file_url
+        self.file_size = file_size
+        self.upload_date = upload_date
+        self.hash = hash
+    
+    @classmethod
+    def from_json(cls, data):
+        """从服务器返回的字典创建，缺少必需字段或类型不对时抛出ValueError"""
+        try:
+            material_id = data["id"]
+            file_url = data["fileUrl"]
+        except (KeyError, TypeError):
+            raise ValueError("缺少id或fileUrl")
+        if material_id is None or not isinstance(file_url, str):
+            raise ValueError("id或fileUrl格式不正确")
+        try:
+            file_size = int(data.get("fileSize") or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"文件大小格式不正确: {data.get('fileSize')!r}")
+        return cls(str(material_id),
+                   str(data.get("title") or ""),
+                   sys.intern(str(data.get("category") or "")),
+                   str(data.get("description") or ""),
+                   file_url,
+                   file_size,
+                   sys.intern(str(data.get("uploadDate") or "")),
+                   data.get("hash") or None)
+    
+    def __eq__(self, other):
+        if not isinstance(other, Material):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+    
+    def __repr__(self):
+        return f"Material({self.id!r}, {self.title!r})"
+
+def parse_materials(items):
+    """把服务器返回的课件列表转换为Material列表，跳过格式不正确的课件"""
+    materials = []
+    for data in items:
+        try:
+            materials.append(Material.from_json(data))
+        except ValueError as e:
+            print(f"忽略格式不正确的课件: {e}")
+    return materials
+
+class MaterialCatalog:
+    """内存中的课件目录：课件ID -> Material（保持服务器返回的顺序），并按科目分组"""
+    
+    def __init__(self):
+        self.materials = {}
+        self.categories = {}
+    
+    def __len__(self):
+        return len(self.materials)
+    
+    def __contains__(self, material_id):
+        return material_id in self.materials
+    
+    def __getitem__(self, material_id):
+        return self.materials[material_id]
+    
+    def get(self, material_id, default=None):
+        return self.materials.get(material_id, default)
+    
+    def values(self):
+        return self.materials.values()
+    
+    def in_category(self, category):
+        """某个科目的课件，"全部"返回所有课件"""
+        if category == "全部":
+            return self.materials.values()
+        return self.categories.get(category, {}).values()
+    
+    def put(self, material):
+        old = self.materials.get(material.id)
+        if old is not None and old.category != material.category:
+            self.discard_from_category(old)
+        self.materials[material.id] = material
+        self.categories.setdefault(material.category, {})[material.id] = material
+    
+    def pop(self, material_id):
+        material = self.materials.pop(material_id, None)
+        if material is not None:
+            self.discard_from_category(material)
+        return material
+    
+    def discard_from_category(self, material):
+        group = self.categories.get(material.category)
+        if group is not None:
+            group.pop(material.id, None)
+            if not group:
+                del self.categories[material.category]
+
+def fetch_catalog_changes(version=None, etag=None, timeout=10):
+    """获取自version以来的课件目录变化
+
+    返回 (changes, etag)，目录没有变化时changes为None。
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    params = {"since": version} if version else {}
+    started = time.monotonic()
+    try:
+        response = mirror_pool.request("GET", "/api/materials", params=params,
+                                       headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            changes = None
+        else:
+            response.raise_for_status()
+            changes = normalize_catalog_changes(response.json())
+            etag = response.headers.get("ETag")
+    except Exception as e:
+        metrics.inc("nextppt_catalog_fetches_total", result="error")
+        metrics.log(f"获取课件目录失败: {e}")
+        raise
+    metrics.observe("nextppt_catalog_fetch_seconds", time.monotonic() - started)
+    metrics.inc("nextppt_catalog_fetches_total", result="changed" if changes else "unchanged")
+    return changes, etag
+
+def normalize_catalog_changes(data):
+    """把服务器返回的各种格式统一为增量格式，课件转换为Material"""
+    if isinstance(data, list):
+        return {"version": None, "full": True, "added": parse_materials(data), "updated": [], "deleted": []}
+    if data.get("full"):
+        return {"version": data.get("version"), "full": True,
+                "added": parse_materials(data.get("materials", [])), "updated": [], "deleted": []}
+    return {"version": data.get("version"), "full": False,
+            "added": parse_materials(data.get("added", [])), "updated": parse_materials(data.get("updated", [])),
+            "deleted": [str(material_id) for material_id in data.get("deleted", [])]}
+
+# 课件目录同步线程：订阅服务器推送，不支持推送时定时轮询
+class CatalogSyncThread(QThread):
+    changes_signal = pyqtSignal(object)  # 目录变化（normalize_catalog_changes的格式）
+    
+    def __init__(self, version=None, etag=None):
+        super().__init__()
+        self.version = version
+        self.etag = etag
+        self.stopped = threading.Event()
+        self.response = None
+    
+    def stop(self):
+        self.stopped.set()
+        # 关闭推送连接，让阻塞中的读取立即返回
+        if self.response is not None:
+            transport.abort(self.response)
+        self.wait()
+    
+    def poll_interval(self):
+        """下一次轮询前等待的时间（秒），0表示不再轮询"""
+        if CATALOG_POLL_INTERVAL <= 0:
+            return 0
+        if self.version is None and not self.etag:
+            # 服务器不支持增量也不支持ETag，每次都要下载完整目录，大幅放慢轮询
+            return max(CATALOG_POLL_INTERVAL, CATALOG_FULL_POLL_INTERVAL) if CATALOG_FULL_POLL_INTERVAL > 0 else 0
+        return CATALOG_POLL_INTERVAL
+    
+    def run(self):
+        while True:
+            if CATALOG_EVENTS_ENABLED:
+                try:
+                    self.listen_events()
+                except Exception as e:
+                    if not self.stopped.is_set():
+                        print(f"课件目录推送连接断开: {e}")
+                # 推送断开后等待一会儿再重连，期间用一次轮询补上漏掉的变化
+                interval = CATALOG_POLL_INTERVAL or 10
+            else:
+                interval = self.poll_interval()
+                if interval <= 0:
+                    return
+            if self.stopped.wait(interval):
+                return
+            try:
+                changes, self.etag = fetch_catalog_changes(self.version, self.etag)
+                if changes:
+                    self.publish(changes)
+            except Exception as e:
+                print(f"同步课件目录失败: {e}")
+    
+    def listen_events(self):
+        params = {"since": self.version} if self.version else {}
+        with transport.request("GET", f"{mirror_pool.best()}{CATALOG_EVENTS_PATH}", params=params,
+                               stream=True, timeout=(10, None)) as response:
+            self.response = response
+            response.raise_for_status()
+            # 事件流规定使用UTF-8，响应头中通常没有charset，requests会默认按ISO-8859-1解码
+            response.encoding = "utf-8"
+            data = []
+            for line in response.iter_lines(decode_unicode=True):
+                if self.stopped.is_set():
+                    return
+                if line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    # 空行表示一个事件结束
+                    self.publish(normalize_catalog_changes(json.loads("\n".join(data))))
+                    data = []
+    
+    def publish(self, changes):
+        if changes["version"] is not None:
+            self.version = changes["version"]
+        self.changes_signal.emit(changes)
+
+# 本地课件库索引：用多个进程解析已下载的演示文稿，提取页数、每页文字和文档属性，供搜索和卡片显示。
+# 索引按路径保存修改时间和大小，只有新增或变化的文件会重新解析。
+LIBRARY_INDEX_FILE = os.path.join(STORE_DIR, "library.json")
+LIBRARY_INDEX_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # 解析进程数，留一个核心给界面
+LIBRARY_SCAN_INTERVAL = 300  # 定时重新扫描下载目录的间隔（秒），0表示只在启动和下载完成后扫描
+LIBRARY_TEXT_LIMIT = 200000  # 每个文件最多保存的文字数
+LIBRARY_EXTENSIONS = (".pptx", ".pptm", ".ppsx", ".ppsm", ".potx")  # 能按zip解析的格式，旧的.ppt不解析
+LIBRARY_SAVE_EVERY = 200  # 每解析这么多个文件保存一次索引，中途退出时不必从头开始
+
+PPTX_NAMESPACES = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "cp": "http://schemas.openxmlformats.org/package/2006/metadata/core-properties",
+    "dcterms": "http://purl.org/dc/terms/",
+}
+
+def library_key(path):
+    """索引和下载记录中的路径统一成同一种写法"""
+    return os.path.normcase(os.path.abspath(path))
+
+def presentation_slide_parts(archive):
+    """按放映顺序返回幻灯片在压缩包中的路径"""
+    names = set(archive.namelist())
+    try:
+        presentation = ElementTree.fromstring(archive.read("ppt/presentation.xml"))
+        rels = ElementTree.fromstring(archive.read("ppt/_rels/presentation.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{{{PPTX_NAMESPACES['rel']}}}Relationship")}
+        parts = []
+        for slide_id in presentation.iter(f"{{{PPTX_NAMESPACES['p']}}}sldId"):
+            target = targets.get(slide_id.get(f"{{{PPTX_NAMESPACES['r']}}}id"), "")
+            part = target.lstrip("/") if target.startswith("/") else "ppt/" + target
+            if part in names:
+                parts.append(part)
+        return parts
+    except (KeyError, ElementTree.ParseError):
+        # 缺少关系文件时按文件名中的编号排序
+        slides = [name for name in names if re.fullmatch(r"ppt/slides/slide\d+\.xml", name)]
+        return sorted(slides, key=lambda name: int(re.search(r"(\d+)\.xml$", name).group(1)))
+
+def index_presentation(path):
+    """解析一个演示文稿（在子进程中运行），直接读取压缩包中的XML，不解压到磁盘"""
+    info = {"slides": 0, "title": "", "author": "", "modified": "", "text": ""}
+    try:
+        with zipfile.ZipFile(path) as archive:
+            texts = []
+            length = 0
+            parts = presentation_slide_parts(archive)
+            for part in parts:
+                if length >= LIBRARY_TEXT_LIMIT:
+                    break
+                slide = ElementTree.fromstring(archive.read(part))
+                for paragraph in slide.iter(f"{{{PPTX_NAMESPACES['a']}}}p"):
+                    line = "".join(t.text or "" for t in paragraph.iter(f"{{{PPTX_NAMESPACES['a']}}}t")).strip()
+                    if line:
+                        texts.append(line)
+                        length += len(line) + 1
+            info["slides"] = len(parts)
+            info["text"] = "\n".join(texts)[:LIBRARY_TEXT_LIMIT]
+            
+            if "docProps/core.xml" in archive.namelist():
+                core = ElementTree.fromstring(archive.read("docProps/core.xml"))
+                for key, tag in (("title", "dc:title"), ("author", "dc:creator"), ("modified", "dcterms:modified")):
+                    element = core.find(tag, PPTX_NAMESPACES)
+                    if element is not None and element.text:
+                        info[key] = element.text.strip()
+    except Exception as e:
+        # 损坏的文件也记入索引，文件变化之前不再重复解析
+        info["error"] = str(e)
+    return info
+
+def load_library_index():
+    try:
+        with open(LIBRARY_INDEX_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_library_index(index):
+    try:
+        temp_path = LIBRARY_INDEX_FILE + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(temp_path, LIBRARY_INDEX_FILE)
+    except OSError as e:
+        print(f"保存课件库索引失败: {e}")
+
+# 课件库索引线程：扫描下载目录，把新增或变化的文件交给进程池解析
+class LibraryIndexThread(QThread):
+    indexed_signal = pyqtSignal(object)  # {课件ID: 索引条目}
+    
+    def __init__(self):
+        super().__init__()
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+    
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        self.wait()
+    
+    def rescan(self):
+        """下载完成后调用，提前开始下一次扫描"""
+        self.wakeup.set()
+    
+    def run(self):
+        index = load_library_index()
+        while not self.stopped.is_set():
+            try:
+                self.scan(index)
+            except Exception as e:
+                print(f"扫描课件库失败: {e}")
+            self.wakeup.wait(LIBRARY_SCAN_INTERVAL or None)
+            self.wakeup.clear()
+    
+    def scan(self, index):
+        # 只stat文件，修改时间和大小都没变的文件沿用原来的结果
+        found = {}
+        for root, dirs, files in os.walk(DOWNLOAD_DIR):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.lower().endswith(LIBRARY_EXTENSIONS) and not name.startswith("~$"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[library_key(path)] = (path, stat.st_mtime, stat.st_size)
+        
+        changed = False
+        for key in [key for key in index if key not in found]:
+            del index[key]
+            changed = True
+        pending = [(key, path, mtime, size) for key, (path, mtime, size) in found.items()
+                   if (index.get(key, {}).get("mtime"), index.get(key, {}).get("size")) != (mtime, size)]
+        
+        if pending:
+            changed = True
+            workers = min(LIBRARY_INDEX_WORKERS, len(pending))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                # 同时提交的任务不超过进程数的两倍，退出时不必等待整个队列
+                queued = iter(pending)
+                running = {}
+                done_count = 0
+                for item in itertools.islice(queued, workers * 2):
+                    running[executor.submit(index_presentation, item[1])] = item
+                while running:
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        key, path, mtime, size = running.pop(future)
+                        index[key] = dict(future.result(), path=path, mtime=mtime, size=size)
+                        done_count += 1
+                        if done_count % LIBRARY_SAVE_EVERY == 0:
+                            save_library_index(index)
+                        if not self.stopped.is_set():
+                            for item in itertools.islice(queued, 1):
+                                running[executor.submit(index_presentation, item[1])] = item
+        
+        if changed:
+            save_library_index(index)
+        if not self.stopped.is_set():
+            self.indexed_signal.emit(self.entries_by_material(index))
+    
+    def entries_by_material(self, index):
+        """通过下载记录把索引条目对应到课件ID"""
+        try:
+            with open(DOWNLOAD_RECORD_FILE, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        entries = {}
+        for record in records:
+            entry = index.get(library_key(record.get("path", "")))
+            if entry:
+                entries[record["id"]] = entry
+        return entries
 
 # 课件卡片组件
 class MaterialCard(CardWidget):
@@ -435,37 +2554,52 @@ class DownloadDialog(QDialog):
         self.last_update_time = None
         self.last_downloaded = 0
         
-        # 用于跟踪每个线程的下载进度
-        self.thread_progress = {}
-        
         # 下载管理器引用
         self.download_manager = None
-        
-        # 取消按钮
+        # 下载完成或失败后，关闭窗口不再取消下载
+        self.download_finished = False
+        
+        # 暂停/继续和取消按钮
+        button_layout = QHBoxLayout()
+        button_layout.addStretch(1)
+        self.pause_btn = QPushButton("暂停")
+        self.pause_btn.clicked.connect(self.toggle_pause)
+        button_layout.addWidget(self.pause_btn)
         self.cancel_btn = QPushButton("取消")
         self.cancel_btn.clicked.connect(self.reject)
-        layout.addWidget(self.cancel_btn, alignment=Qt.AlignRight)
+        button_layout.addWidget(self.cancel_btn)
+        layout.addLayout(button_layout)
+    
+    def toggle_pause(self):
+        if not self.download_manager:
+            return
+        if self.download_manager.paused:
+            self.download_manager.resume()
+            self.pause_btn.setText("暂停")
+            self.info_label.setText("继续下载...")
+            # 重新开始计算速度，不把暂停的时间算进去
+            self.last_update_time = datetime.now()
+        else:
+            self.download_manager.pause()
+            self.pause_btn.setText("继续")
+            self.info_label.setText("已暂停，已下载的部分会保留")
+    
+    def reject(self):
+        # 点击取消或关闭窗口时停止下载并删除临时文件
+        if self.download_manager and not self.download_finished:
+            self.download_manager.cancel()
+        super().reject()
     
     def update_progress(self, current, total):
-        # 获取线程ID（从调用堆栈中获取）
-        thread_id = self.sender().thread_id if hasattr(self.sender(), 'thread_id') else 0
-        
-        # 确保self.thread_progress已初始化
-        if not hasattr(self, 'thread_progress') or self.thread_progress is None:
-            self.thread_progress = {}
-            
-        # 更新此线程的进度
-        self.thread_progress[thread_id] = current
-        
-        # 计算所有线程的总进度
-        total_downloaded = sum(self.thread_progress.values())
+        # current和total由DownloadManager汇总所有分段得出（增量更新时只计需要下载的部分）
+        total_downloaded = current
         
-        # 确保download_manager和total_size有效，避免除零错误
-        if not hasattr(self, 'download_manager') or not self.download_manager or not hasattr(self.download_manager, 'total_size') or self.download_manager.total_size <= 0:
+        # 避免除零错误
+        if total <= 0:
             return
             
         # 计算总进度百分比，使用浮点数计算以获得更平滑的进度
-        progress_percent = (total_downloaded / self.download_manager.total_size) * 100.0
+        progress_percent = (total_downloaded / total) * 100.0
         
         # 确保总进度不超过100%，并保留一位小数以使进度更平滑
         progress = min(progress_percent, 100.0)
@@ -484,6 +2618,11 @@ class DownloadDialog(QDialog):
         if not hasattr(self, 'last_downloaded') or self.last_downloaded is None:
             self.last_downloaded = 0
         
+        # 暂停后仍在路上的进度信号不覆盖"已暂停"的提示
+        if self.download_manager and self.download_manager.paused:
+            self.last_downloaded = total_downloaded
+            return
+        
         # 计算下载速度（每秒）
         now = datetime.now()
         time_diff = (now - self.last_update_time).total_seconds()
@@ -491,9 +2630,9 @@ class DownloadDialog(QDialog):
             bytes_diff = total_downloaded - self.last_downloaded
             speed = bytes_diff / time_diff if time_diff > 0 else 0  # 字节/秒，避免除零错误
             
-            # 计算剩余时间，确保使用正确的total_size
-            if speed > 0 and self.download_manager.total_size > 0:
-                remaining_bytes = self.download_manager.total_size - total_downloaded
+            # 计算剩余时间
+            if speed > 0:
+                remaining_bytes = total - total_downloaded
                 remaining_seconds = remaining_bytes / speed
                 remaining_time = self.format_time(remaining_seconds)
             else:
@@ -532,6 +2671,8 @@ class DownloadDialog(QDialog):
             return f"{size_bytes/(1024*1024*1024):.2f}GB"
     
     def download_error(self, error):
+        self.download_finished = True
+        self.pause_btn.setEnabled(False)
         self.progress_bar.setValue(0)
         self.info_label.setText(f"下载失败: {error}")
         self.cancel_btn.setText("关闭")
@@ -543,6 +2684,8 @@ class DownloadDialog(QDialog):
         )
 
     def download_completed(self):
+        self.download_finished = True
+        self.pause_btn.setEnabled(False)
         self.progress_bar.setValue(100)
         self.info_label.setText("下载完成!")
         self.cancel_btn.setText("关闭")
@@ -552,10 +2695,14 @@ class DownloadDialog(QDialog):
 
 # 课件卡片组件
 class MaterialCard(CardWidget):
+    selection_changed = pyqtSignal(object, bool)  # 课件ID, 是否选中（多选模式）
+    
     def __init__(self, material, parent=None):
         super().__init__(parent)
         self.material = material
         self.downloaded = False
+        # 固定的课件不会在空间不足时被自动清理
+        self.pinned = False
         # 设置卡片大小，可根据窗口大小自动调整
         self.setMinimumSize(350, 180)  # 设置更宽的卡片宽度
         self.setMaximumWidth(400)
@@ -573,7 +2720,7 @@ class MaterialCard(CardWidget):
         top_layout.setSpacing(10)
         
         # 标题
-        title_label = StrongBodyLabel(self.material["title"])
+        title_label = StrongBodyLabel(self.material.title)
         title_label.setWordWrap(True)
         title_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
         
@@ -591,19 +2738,26 @@ class MaterialCard(CardWidget):
             }
         """)
         
-        category_label = CaptionLabel(self.material["category"])
+        category_label = CaptionLabel(self.material.category)
         category_label.setStyleSheet("color: #0277bd;")
         category_layout.addWidget(category_label)
         category_widget.setLayout(category_layout)
         category_widget.setFixedHeight(22)
         
+        # 多选模式下显示的复选框
+        self.select_box = CheckBox()
+        self.select_box.setVisible(False)
+        self.select_box.stateChanged.connect(
+            lambda state: self.selection_changed.emit(self.material.id, state == Qt.Checked))
+        top_layout.addWidget(self.select_box, 0)
+        
         top_layout.addWidget(title_label, 1)  # 1表示伸展因子
         top_layout.addWidget(category_widget, 0)  # 0表示不伸展
         layout.addLayout(top_layout)
         
         # 副标题（使用description作为副标题）
-        if "description" in self.material and self.material["description"]:
-            subtitle_label = BodyLabel(self.material["description"])
+        if self.material.description:
+            subtitle_label = BodyLabel(self.material.description)
             subtitle_label.setWordWrap(True)
             layout.addWidget(subtitle_label)
         
@@ -618,13 +2772,23 @@ class MaterialCard(CardWidget):
         info_layout.setSpacing(2)
         
         # 文件大小
-        size_label = CaptionLabel(self.format_size(self.material["fileSize"]))
+        size_label = CaptionLabel(self.format_size(self.material.file_size))
         info_layout.addWidget(size_label)
         
         # 日期
-        date_label = CaptionLabel(self.material["uploadDate"])
+        date_label = CaptionLabel(self.material.upload_date)
         info_layout.addWidget(date_label)
         
+        # 页数（已下载的文件被本地课件库索引后显示）
+        self.slides_label = CaptionLabel()
+        self.slides_label.setVisible(False)
+        info_layout.addWidget(self.slides_label)
+        
+        # 固定标记（右键菜单中设置）
+        self.pin_label = CaptionLabel("已固定")
+        self.pin_label.setVisible(False)
+        info_layout.addWidget(self.pin_label)
+        
         bottom_layout.addLayout(info_layout)
         bottom_layout.addStretch(1)  # 添加弹性空间
         
@@ -663,6 +2827,21 @@ class MaterialCard(CardWidget):
             size_in_bytes /= 1024.0
         return f"{size_in_bytes:.2f} TB"
     
+    def set_selectable(self, selectable, checked=False):
+        """进入或退出多选模式"""
+        self.select_box.blockSignals(True)
+        self.select_box.setChecked(selectable and checked)
+        self.select_box.blockSignals(False)
+        self.select_box.setVisible(selectable)
+    
+    def set_library_info(self, entry):
+        """显示本地课件库索引中的页数"""
+        if entry and entry.get("slides"):
+            self.slides_label.setText(f"{entry['slides']} 页")
+            self.slides_label.setVisible(True)
+        else:
+            self.slides_label.setVisible(False)
+    
     def check_if_downloaded(self):
         """检查课件是否已下载"""
         try:
@@ -672,7 +2851,10 @@ class MaterialCard(CardWidget):
             
             # 检查当前课件是否已下载
             for record in records:
-                if record["id"] == self.material["id"]:
+                if record["id"] == self.material.id:
+                    self.downloaded = True
+                    self.pinned = record.get("pinned", False)
+                    self.pin_label.setVisible(self.pinned)
                     self.download_btn.setText("打开文件")
                     # 不使用图标，避免重叠问题
                     # 更新按钮样式，与图片中一致
@@ -695,38 +2877,106 @@ class MaterialCard(CardWidget):
             print(f"检查下载记录失败: {e}")
     
     def download_material(self):
-        # 获取文件URL
-        file_url = f"{SERVER_URL}{self.material['fileUrl']}"
+        # 获取文件在服务器上的路径（由镜像池选择从哪个服务器下载）
+        file_url = self.material.file_url
         
         # 获取文件名
-        file_name = os.path.basename(self.material["fileUrl"])
+        file_name = os.path.basename(self.material.file_url)
         save_path = os.path.join(DOWNLOAD_DIR, file_name)
         
         # 创建下载管理器
         self.download_manager = DownloadManager(file_url, save_path, 
-                                              self.material["id"], self.material["title"])
+                                              self.material.id, self.material.title,
+                                              self.material.hash, self.material.upload_date)
         
-        # 创建并显示下载弹窗
-        self.download_dialog = DownloadDialog(self.material["title"], file_name, self)
+        # 创建并显示下载弹窗，弹窗属于主窗口，切换分类或搜索时卡片被重建也不受影响
+        window = self.window()
+        dialog = DownloadDialog(self.material.title, file_name, window)
         # 传递download_manager引用给对话框
-        self.download_dialog.download_manager = self.download_manager
-        self.download_dialog.show()
+        dialog.download_manager = self.download_manager
+        dialog.show()
         
         # 连接信号
-        self.download_manager.progress_signal.connect(self.download_dialog.update_progress)
-        self.download_manager.complete_signal.connect(self.download_completed)
-        self.download_manager.error_signal.connect(self.download_dialog.download_error)
+        self.download_manager.progress_signal.connect(dialog.update_progress)
+        self.download_manager.complete_signal.connect(lambda path: dialog.download_completed())
+        self.download_manager.error_signal.connect(dialog.download_error)
+        
+        # 由主窗口记录正在进行的下载，重建的卡片会重新连接到它
+        if hasattr(window, "track_download"):
+            window.track_download(self.material.id, self.download_manager, dialog)
+        self.attach_download(self.download_manager, dialog)
         
         # 开始下载
+        self.download_manager.start()
+    
+    def attach_download(self, manager, dialog):
+        """连接正在进行的下载，按钮显示为下载中"""
+        self.download_manager = manager
+        self.download_dialog = dialog
+        manager.complete_signal.connect(self.download_completed)
+        manager.error_signal.connect(self.download_stopped)
+        manager.cancelled_signal.connect(self.download_stopped)
         self.download_btn.setEnabled(False)
         self.download_btn.setText("下载中...")
-        self.download_manager.start()
+    
+    def set_not_downloaded(self):
+        """课件被清理后恢复为未下载状态"""
+        self.downloaded = False
+        self.pinned = False
+        self.pin_label.setVisible(False)
+        self.slides_label.setVisible(False)
+        self.download_btn.setText("下载文件")
+        self.download_btn.setEnabled(True)
+        self.download_btn.clicked.disconnect()
+        self.download_btn.clicked.connect(self.download_material)
+        self.download_btn.setStyleSheet("""
+            PushButton {
+                border: 1px solid #0078d4;
+                border-radius: 4px;
+                padding: 5px 10px;
+                background-color: #ffffff;
+                color: #0078d4;
+            }
+            PushButton:hover {
+                background-color: #e6f7ff;
+            }
+        """)
+    
+    def contextMenuEvent(self, event):
+        # 已下载的课件可以固定，固定后空间不足时也不会被自动清理
+        if not self.downloaded:
+            return
+        menu = RoundMenu(parent=self)
+        action = Action("取消固定" if self.pinned else "固定（不自动清理）")
+        action.triggered.connect(self.toggle_pinned)
+        menu.addAction(action)
+        menu.exec(event.globalPos())
+    
+    def toggle_pinned(self):
+        self.pinned = not self.pinned
+        self.pin_label.setVisible(self.pinned)
+        update_record_fields(self.material.id, pinned=self.pinned)
+    
+    def download_stopped(self, *args):
+        # 下载取消或失败后恢复下载按钮，可以重新下载
+        self.download_btn.setText("下载文件")
+        self.download_btn.setEnabled(True)
     
     def download_completed(self, file_path):
-        # 关闭下载弹窗
-        if hasattr(self, 'download_dialog') and self.download_dialog:
-            self.download_dialog.download_completed()
+        # 下载弹窗由下载管理器的信号直接关闭
+        self.set_downloaded(file_path)
+        
+        # 让本地课件库索引新下载的文件
+        window = self.window()
+        if hasattr(window, "library_indexer"):
+            window.library_indexer.rescan()
         
+        # 自动打开文件
+        QTimer.singleShot(500, lambda: self.open_file(file_path))
+    
+    def set_downloaded(self, file_path):
+        """把按钮切换为打开文件"""
+        self.downloaded = True
         self.download_btn.setText("打开文件")
         self.download_btn.setEnabled(True)
         self.download_btn.clicked.disconnect()
@@ -745,15 +2995,13 @@ class MaterialCard(CardWidget):
                 background-color: #cce9ff;
             }
         """)
-        
-        # 自动打开文件
-        QTimer.singleShot(500, lambda: self.open_file(file_path))
     
     def open_file(self, file_path):
         try:
             if os.path.exists(file_path):
-                # 使用系统默认程序打开文件
+                # 使用系统默认程序打开文件，记录打开时间供空间不足时决定先清理哪些课件
                 QDesktopServices.openUrl(QUrl.fromLocalFile(file_path))
+                update_record_fields(self.material.id, accessed=time.time())
             else:
                 QMessageBox.warning(self, "文件不存在", "文件不存在或已被移动")
                 # 重置按钮状态
@@ -774,8 +3022,9 @@ class MaterialCard(CardWidget):
     def open_file(self, file_path):
         try:
             if os.path.exists(file_path):
-                # 使用系统默认程序打开文件
+                # 使用系统默认程序打开文件，记录打开时间供空间不足时决定先清理哪些课件
                 QDesktopServices.openUrl(QUrl.fromLocalFile(file_path))
+                update_record_fields(self.material.id, accessed=time.time())
             else:
                 QMessageBox.warning(self, "文件不存在", "文件不存在或已被移动")
                 # 重置按钮状态
@@ -790,6 +3039,37 @@ class MaterialCard(CardWidget):
             self.download_btn.clicked.disconnect()
             self.download_btn.clicked.connect(self.download_material)
 
+# 接收后来启动的实例转发的参数
+class InstanceServer(QObject):
+    arguments_signal = pyqtSignal(list)  # 启动参数（可能为空，只需要切换到前台）
+    
+    def __init__(self):
+        super().__init__()
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.accept_connections)
+    
+    def listen(self):
+        return self.server.listen(instance_server_name())
+    
+    def accept_connections(self):
+        while self.server.hasPendingConnections():
+            connection = self.server.nextPendingConnection()
+            connection.readyRead.connect(lambda connection=connection: self.read_arguments(connection))
+            connection.disconnected.connect(connection.deleteLater)
+            self.read_arguments(connection)
+    
+    def read_arguments(self, connection):
+        if not connection.canReadLine():
+            return
+        try:
+            args = [str(arg) for arg in json.loads(bytes(connection.readLine())).get("args", [])]
+        except (ValueError, AttributeError) as e:
+            print(f"无法解析转发的启动参数: {e}")
+            args = []
+        connection.write(b"ok\n")
+        connection.flush()
+        self.arguments_signal.emit(args)
+
 # 主窗口类
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -808,10 +3088,56 @@ class MainWindow(QMainWindow):
         self.center_window()
         # 加载字体
         self.load_fonts()
+        # 内存中的课件目录（课件ID -> Material），由同步线程增量更新
+        self.catalog = MaterialCatalog()
+        self.catalog_version = None
+        self.catalog_etag = None
+        self.catalog_sync = None
+        # 当前显示的卡片（课件ID -> 卡片）
+        self.cards = {}
+        self.current_category = "全部"
+        # 本地课件库索引（课件ID -> 页数、文字等）和搜索框内容
+        self.library = {}
+        self.library_text = {}
+        self.search_text = ""
+        # 多选模式和选中的课件ID
+        self.multi_select = False
+        self.selected = set()
+        self.bundle_download = None
+        # 正在进行的单个课件下载（课件ID -> (下载管理器, 下载弹窗)），卡片重建时重新连接
+        self.downloads = {}
+        # 开始定时测量各镜像的延迟
+        mirror_pool.start_probing()
+        # 开启局域网节点缓存时，向其他客户端提供已下载的文件
+        if PEER_CACHE_ENABLED:
+            peer_cache.start()
+        # 开启运行指标时，用定时器晚到的时间衡量界面卡顿
+        if METRICS_ENABLED:
+            metrics.start()
+            self.stall_timer = QTimer(self)
+            self.stall_timer.setTimerType(Qt.PreciseTimer)
+            self.stall_timer.setInterval(100)
+            self.stall_timer.timeout.connect(self.check_stall)
+            self.stall_expected = time.monotonic() + 0.1
+            self.stall_timer.start()
         # 初始化UI
         self.init_ui()
+        # 在后台索引已下载的课件
+        self.library_indexer = LibraryIndexThread()
+        self.library_indexer.indexed_signal.connect(self.apply_library_index)
+        self.library_indexer.start()
+        # 空间不足时被自动清理的课件恢复为未下载
+        download_events.evicted_signal.connect(self.materials_evicted)
         # 不再需要单独加载分类，因为已经在init_ui中加载到ComboBox
     
+    def check_stall(self):
+        now = time.monotonic()
+        late = now - self.stall_expected
+        self.stall_expected = now + self.stall_timer.interval() / 1000
+        if late > METRICS_STALL_THRESHOLD:
+            metrics.inc("nextppt_ui_stalls_total")
+            metrics.observe("nextppt_ui_stall_seconds", late)
+    
     def center_window(self):
         """使窗口在屏幕中央显示"""
         screen_geo = QApplication.desktop().screenGeometry()
@@ -869,6 +3195,24 @@ class MainWindow(QMainWindow):
         top_layout.addWidget(title_label)
         top_layout.addStretch(1)
         
+        # 多选后一次打包下载
+        self.select_btn = TogglePushButton("多选")
+        self.select_btn.toggled.connect(self.toggle_multi_select)
+        top_layout.addWidget(self.select_btn)
+        self.bundle_btn = PushButton("下载所选")
+        self.bundle_btn.setVisible(False)
+        self.bundle_btn.setEnabled(False)
+        self.bundle_btn.clicked.connect(self.download_selected)
+        top_layout.addWidget(self.bundle_btn)
+        
+        # 搜索框：匹配标题、简介和已下载课件中的幻灯片文字
+        from qfluentwidgets import SearchLineEdit
+        self.search_edit = SearchLineEdit()
+        self.search_edit.setPlaceholderText("搜索课件内容")
+        self.search_edit.setFixedWidth(240)
+        self.search_edit.textChanged.connect(self.search_materials)
+        top_layout.addWidget(self.search_edit)
+        
         # 右上角添加ComboBox分类选择器
         from qfluentwidgets import ComboBox
         self.category_combobox = ComboBox()
@@ -879,7 +3223,7 @@ class MainWindow(QMainWindow):
         layout.addLayout(top_layout)
         
         # 课件卡片滚动区域
-        scroll_area = SmoothScrollArea()
+        self.scroll_area = scroll_area = SmoothScrollArea()
         scroll_area.setWidgetResizable(True)
         
         # 课件卡片容器
@@ -898,7 +3242,7 @@ class MainWindow(QMainWindow):
     def load_categories(self):
         try:
             # 获取分类列表
-            response = requests.get(f"{SERVER_URL}/api/categories")
+            response = mirror_pool.request("GET", "/api/categories", timeout=10)
             categories = response.json()
             
             # 添加"全部"选项
@@ -916,21 +3260,26 @@ class MainWindow(QMainWindow):
     def load_categories_to_combobox(self):
         """将分类加载到ComboBox中"""
         try:
-            response = requests.get(f"{SERVER_URL}/api/categories")
+            response = mirror_pool.request("GET", "/api/categories", timeout=10)
             categories = response.json()
             
-            # 清空ComboBox
-            self.category_combobox.clear()
-            
-            # 添加全部分类
-            self.category_combobox.addItem("全部")
-            
-            # 添加其他分类
-            for category in categories:
-                self.category_combobox.addItem(category["name"])
+            # 填充期间不触发切换分类，第一次添加选项时ComboBox也会发出currentTextChanged
+            self.category_combobox.blockSignals(True)
+            try:
+                # 清空ComboBox
+                self.category_combobox.clear()
+                
+                # 添加全部分类
+                self.category_combobox.addItem("全部")
                 
-            # 设置默认选中全部
-            self.category_combobox.setCurrentText("全部")
+                # 添加其他分类
+                for category in categories:
+                    self.category_combobox.addItem(category["name"])
+                    
+                # 设置默认选中全部
+                self.category_combobox.setCurrentText("全部")
+            finally:
+                self.category_combobox.blockSignals(False)
             
             # 默认加载全部分类的课件
             self.load_materials("全部")
@@ -955,19 +3304,16 @@ class MainWindow(QMainWindow):
         try:
             # 清空现有课件
             self.clear_materials()
+            self.current_category = category
             
-            # 获取课件列表
-            response = requests.get(f"{SERVER_URL}/api/materials")
-            materials = response.json()
-            
-            # 根据分类筛选
-            if category != "全部":
-                materials = [m for m in materials if m["category"] == category]
+            # 首次加载时获取完整目录，之后由同步线程增量更新，切换分类不再请求服务器
+            if self.catalog_sync is None:
+                self.sync_catalog()
             
             # 添加课件卡片 - 使用FlowLayout自动排列
-            for material in materials:
-                card = MaterialCard(material)
-                self.materials_layout.addWidget(card)
+            for material in self.catalog.in_category(category):
+                if self.search_matches(material):
+                    self.add_card(material)
         except Exception as e:
             QMessageBox.critical(
                 self,
@@ -975,6 +3321,242 @@ class MainWindow(QMainWindow):
                 f"加载课件失败: {e}"
             )
     
+    def sync_catalog(self):
+        """获取完整课件目录并启动后台同步线程"""
+        changes, self.catalog_etag = fetch_catalog_changes()
+        # 卡片由调用方load_materials统一创建
+        self.apply_catalog_changes(changes, update_cards=False)
+        
+        self.catalog_sync = CatalogSyncThread(self.catalog_version, self.catalog_etag)
+        self.catalog_sync.changes_signal.connect(self.apply_catalog_changes)
+        self.catalog_sync.start()
+    
+    def apply_catalog_changes(self, changes, update_cards=True):
+        """把目录变化应用到内存目录和已显示的卡片上，不重建整个列表"""
+        if changes["full"]:
+            fresh = {m.id: m for m in changes["added"]}
+            deleted = [material_id for material_id in self.catalog.materials if material_id not in fresh]
+            changed = [m for m in fresh.values() if self.catalog.get(m.id) != m]
+        else:
+            deleted = changes["deleted"]
+            changed = changes["added"] + changes["updated"]
+        
+        for material_id in deleted:
+            self.catalog.pop(material_id)
+            if update_cards:
+                self.remove_card(material_id)
+        for material in changed:
+            self.catalog.put(material)
+            if update_cards:
+                self.update_card(material)
+        
+        if changes["version"] is not None:
+            self.catalog_version = changes["version"]
+    
+    def category_matches(self, material):
+        if self.current_category != "全部" and material.category != self.current_category:
+            return False
+        return self.search_matches(material)
+    
+    def search_matches(self, material):
+        """搜索框中的每个词都要出现在标题、简介或幻灯片文字中"""
+        if not self.search_text:
+            return True
+        text = f"{material.title} {material.description}".casefold()
+        library_text = self.library_text.get(material.id, "")
+        return all(word in text or word in library_text for word in self.search_text.split())
+    
+    def search_materials(self, text):
+        self.search_text = text.strip().casefold()
+        self.load_materials(self.current_category)
+    
+    def apply_library_index(self, entries):
+        """课件库索引更新后刷新卡片上的页数，有搜索条件时只重新筛选文字有变化的课件"""
+        old_text = self.library_text
+        self.library = entries
+        self.library_text = {material_id: "\n".join((entry.get("title", ""), entry.get("text", ""))).casefold()
+                             for material_id, entry in entries.items()}
+        for material_id, card in self.cards.items():
+            card.set_library_info(self.library.get(material_id))
+        if not self.search_text:
+            return
+        for material_id in old_text.keys() | self.library_text.keys():
+            if old_text.get(material_id) == self.library_text.get(material_id):
+                continue
+            material = self.catalog.get(material_id)
+            if material is not None and (material_id in self.cards) != self.category_matches(material):
+                self.update_card(material)
+    
+    def materials_evicted(self, material_ids):
+        for material_id in material_ids:
+            self.library.pop(material_id, None)
+            self.library_text.pop(material_id, None)
+            if material_id in self.cards:
+                self.cards[material_id].set_not_downloaded()
+    
+    def handle_arguments(self, args):
+        """切换到前台，并处理启动参数中的课件ID：已下载的打开，未下载的开始下载"""
+        if self.isMinimized():
+            self.showNormal()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        for material_id in args:
+            if material_id not in self.catalog:
+                print(f"没有找到课件: {material_id}")
+                continue
+            if material_id not in self.cards:
+                # 被分类或搜索条件隐藏了，先显示全部课件
+                self.search_edit.clear()
+                self.category_combobox.setCurrentText("全部")
+            card = self.cards.get(material_id)
+            if card is None:
+                continue
+            # 等卡片移动动画结束后再滚动到它
+            QTimer.singleShot(self.materials_layout.duration + 100,
+                              lambda material_id=material_id: self.scroll_to_card(material_id))
+            if card.download_btn.isEnabled():
+                card.download_btn.click()
+    
+    def scroll_to_card(self, material_id):
+        card = self.cards.get(material_id)
+        if card:
+            self.scroll_area.ensureWidgetVisible(card)
+    
+    def toggle_multi_select(self, checked):
+        self.multi_select = checked
+        if not checked:
+            self.selected.clear()
+        for material_id, card in self.cards.items():
+            card.set_selectable(checked, material_id in self.selected)
+        self.bundle_btn.setVisible(checked)
+        self.update_bundle_button()
+    
+    def material_selected(self, material_id, checked):
+        if checked:
+            self.selected.add(material_id)
+        else:
+            self.selected.discard(material_id)
+        self.update_bundle_button()
+    
+    def update_bundle_button(self):
+        self.bundle_btn.setText(f"下载所选 ({len(self.selected)})" if self.selected else "下载所选")
+        self.bundle_btn.setEnabled(bool(self.selected) and self.bundle_download is None)
+    
+    def download_selected(self):
+        """把选中的课件作为一个包下载"""
+        materials = [self.catalog[material_id] for material_id in self.selected if material_id in self.catalog]
+        if not materials:
+            return
+        self.bundle_download = BundleDownloadManager(materials)
+        
+        dialog = DownloadDialog(f"{len(materials)}个课件", "打包下载", self)
+        dialog.download_manager = self.bundle_download
+        # 打包下载不支持暂停
+        dialog.pause_btn.setVisible(False)
+        dialog.show()
+        
+        self.bundle_download.progress_signal.connect(dialog.update_progress)
+        self.bundle_download.item_signal.connect(self.bundle_item_completed)
+        self.bundle_download.complete_signal.connect(dialog.download_completed)
+        self.bundle_download.complete_signal.connect(self.bundle_finished)
+        self.bundle_download.error_signal.connect(dialog.download_error)
+        self.bundle_download.error_signal.connect(self.bundle_finished)
+        self.bundle_download.cancelled_signal.connect(self.bundle_finished)
+        
+        for material in materials:
+            card = self.cards.get(material.id)
+            if card:
+                card.download_btn.setEnabled(False)
+                card.download_btn.setText("下载中...")
+        # 退出多选模式（同时清空选择）
+        self.select_btn.setChecked(False)
+        self.bundle_download.start()
+    
+    def bundle_item_completed(self, material_id, file_path):
+        card = self.cards.get(material_id)
+        if card:
+            card.set_downloaded(file_path)
+    
+    def bundle_finished(self, *args):
+        bundle = self.sender()
+        if bundle is not self.bundle_download:
+            return
+        # 没有完成的课件恢复下载按钮，并索引新下载的文件
+        for material in bundle.materials:
+            card = self.cards.get(material.id)
+            if card and material.id not in bundle.done:
+                card.download_stopped()
+        self.bundle_download = None
+        self.update_bundle_button()
+        self.library_indexer.rescan()
+    
+    def track_download(self, material_id, manager, dialog):
+        """记录卡片开始的下载，下载结束前重建的卡片都会重新连接到它"""
+        self.downloads[material_id] = (manager, dialog)
+        manager.complete_signal.connect(lambda path: self.download_finished(material_id, manager, path))
+        manager.error_signal.connect(lambda error: self.download_finished(material_id, manager))
+        manager.cancelled_signal.connect(lambda: self.download_finished(material_id, manager))
+    
+    def download_finished(self, material_id, manager, file_path=None):
+        if self.downloads.get(material_id, (None,))[0] is manager:
+            del self.downloads[material_id]
+        if file_path and material_id not in self.cards:
+            # 卡片被分类或搜索条件隐藏了，卡片不在时由主窗口索引并打开下载的文件
+            self.library_indexer.rescan()
+            QTimer.singleShot(500, lambda: self.open_downloaded(material_id, file_path))
+    
+    def open_downloaded(self, material_id, file_path):
+        if os.path.exists(file_path):
+            QDesktopServices.openUrl(QUrl.fromLocalFile(file_path))
+            update_record_fields(material_id, accessed=time.time())
+    
+    def add_card(self, material, index=-1):
+        card = MaterialCard(material)
+        card.set_library_info(self.library.get(material.id))
+        card.set_selectable(self.multi_select, material.id in self.selected)
+        card.selection_changed.connect(self.material_selected)
+        # 正在下载的课件重新连接到进行中的下载，避免重复下载
+        if material.id in self.downloads:
+            card.attach_download(*self.downloads[material.id])
+        elif (self.bundle_download and material.id not in self.bundle_download.done
+              and any(m.id == material.id for m in self.bundle_download.materials)):
+            card.download_btn.setEnabled(False)
+            card.download_btn.setText("下载中...")
+        self.cards[material.id] = card
+        if index < 0:
+            self.materials_layout.addWidget(card)
+        else:
+            self.materials_layout.insertWidget(index, card)
+    
+    def remove_card(self, material_id):
+        card = self.cards.pop(material_id, None)
+        if card:
+            self.materials_layout.removeWidget(card)
+            card.deleteLater()
+        return card
+    
+    def update_card(self, material):
+        card = self.cards.get(material.id)
+        if card and not card.download_btn.isEnabled():
+            # 正在下载的卡片不重建，只更新数据
+            card.material = material
+            return
+        index = self.materials_layout.indexOf(card) if card else self.card_index(material.id)
+        self.remove_card(material.id)
+        if self.category_matches(material):
+            self.add_card(material, index)
+    
+    def card_index(self, material_id):
+        """新显示的卡片在布局中的位置：排在目录顺序中它之前的已显示卡片之后"""
+        index = 0
+        for other_id in self.catalog.materials:
+            if other_id == material_id:
+                return index
+            if other_id in self.cards:
+                index += 1
+        return -1
+    
     def clear_materials(self):
         # 清空课件布局
         for i in range(self.materials_layout.count()):
@@ -982,9 +3564,19 @@ class MainWindow(QMainWindow):
             if widget:
                 widget.deleteLater()
                 self.materials_layout.removeWidget(widget)
+        self.cards.clear()
+    
+    def closeEvent(self, event):
+        if self.catalog_sync:
+            self.catalog_sync.stop()
+        self.library_indexer.stop()
+        super().closeEvent(event)
 
 # 程序入口
 if __name__ == "__main__":
+    # 打包成exe后，课件库索引的子进程需要这一行才能正常启动
+    multiprocessing.freeze_support()
+    
     # 设置高DPI缩放 - 必须在创建QApplication之前设置
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
@@ -992,12 +3584,32 @@ if __name__ == "__main__":
     # 创建应用程序
     app = QApplication(sys.argv)
     
+    # 开始接收后来启动的实例转发的参数
+    instance_server = None
+    if SINGLE_INSTANCE and not is_multiprocessing_child():
+        instance_server = InstanceServer()
+        if not instance_server.listen():
+            # 另一个实例几乎同时启动并先开始了监听
+            if forward_to_running_instance(sys.argv[1:]):
+                sys.exit(0)
+            # 上次异常退出留下的本地套接字文件
+            QLocalServer.removeServer(instance_server_name())
+            if not instance_server.listen():
+                print(f"无法启动单实例通道: {instance_server.server.errorString()}")
+    
+    # 旧版本的下载记录中课件ID可能是数字，启动时转换一次
+    migrate_download_records()
+    
     # 设置应用程序主题
     setTheme(Theme.DARK)
     
     # 创建并显示主窗口
     window = MainWindow()
     window.show()
+    if instance_server:
+        instance_server.arguments_signal.connect(window.handle_arguments)
+    if sys.argv[1:]:
+        window.handle_arguments(sys.argv[1:])
     
     # 运行应用程序
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""本地替身服务器：把一个目录当作课件服务器，在没有正式服务器时调试客户端
+
+用法: python stub_server.py <课件目录> [端口] [--no-bundle]
+      python stub_server.py --synthetic=<课件数量> [端口] [--file-size=<字节数>]
+
+子目录名作为科目，目录中的文件作为课件。提供 /api/categories、/api/materials、
+/files/<路径>（支持Range）、分块签名 /files/<路径>.sig（增量更新用，由delta.build_signature生成）
+和打包下载接口 /api/materials/bundle。
+加 --no-bundle 时打包下载接口返回404，模拟不支持打包下载的旧服务器。
+加 --synthetic 时不读目录，生成指定数量的虚拟课件（内容按课件ID生成，不占磁盘），用于性能测试。
+把main.py中的SERVER_URL改为 http://127.0.0.1:<端口> 即可连接。
+"""
+import sys
+import os
+import re
+import json
+import hashlib
+import tarfile
+import http.server
+from datetime import datetime
+from urllib.parse import unquote
+
+from delta import build_signature
+
+ROOT = ""
+BUNDLE_ENABLED = True
+MATERIALS = []
+SIGNATURES = {}  # 课件文件路径 -> (修改时间, 分块签名)
+SYNTHETIC_CATEGORIES = ["语文", "数学", "英语", "物理", "化学", "生物", "历史", "地理", "政治", "信息技术", "音乐", "美术"]
+# 虚拟课件的内容：第p个字节为 (p + 课件ID) % 256，每个课件内容不同
+SYNTHETIC_BLOCK = bytes(range(256)) * 4097
+
+
+def scan_materials(root):
+    """扫描目录生成课件列表"""
+    materials = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(block)
+            stat = os.stat(path)
+            materials.append({
+                "id": str(len(materials) + 1),
+                "title": os.path.splitext(name)[0],
+                "category": relpath.split("/")[0] if "/" in relpath else "其他",
+                "description": "",
+                "fileUrl": "/files/" + relpath,
+                "fileSize": stat.st_size,
+                "uploadDate": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d"),
+                "hash": sha256.hexdigest(),
+                "path": path,
+            })
+    return materials
+
+
+def synthetic_materials(count, file_size):
+    """生成count个虚拟课件，按科目轮流分配"""
+    materials = []
+    for i in range(1, count + 1):
+        category = SYNTHETIC_CATEGORIES[i % len(SYNTHETIC_CATEGORIES)]
+        materials.append({
+            "id": str(i),
+            "title": f"{category}课件{i:05d}",
+            "category": category,
+            "description": f"第{(i % 30) + 1}单元 第{(i % 7) + 1}课时 教学课件",
+            "fileUrl": f"/files/synthetic/{i}.pptx",
+            "fileSize": file_size,
+            "uploadDate": "2025-01-01",
+            "path": None,
+        })
+    return materials
+
+
+def read_content(material, start, length):
+    """按块读取课件内容，虚拟课件现场生成"""
+    if material["path"] is None:
+        shift = int(material["id"])
+        while length > 0:
+            offset = (start + shift) % 256
+            block = SYNTHETIC_BLOCK[offset:offset + min(length, 1024 * 1024)]
+            yield block
+            start += len(block)
+            length -= len(block)
+        return
+    with open(material["path"], "rb") as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(1024 * 1024, length))
+            if not block:
+                break
+            yield block
+            length -= len(block)
+
+
+def file_signature(path):
+    """目录中课件的分块签名，文件修改后重新生成"""
+    mtime = os.path.getmtime(path)
+    cached = SIGNATURES.get(path)
+    if not cached or cached[0] != mtime:
+        cached = SIGNATURES[path] = (mtime, build_signature(path))
+    return cached[1]
+
+
+class ChunkedWriter:
+    """把写入的数据按HTTP分块传输编码发送，tar流的总长度事先未知"""
+
+    def __init__(self, wfile, size=64 * 1024):
+        self.wfile = wfile
+        self.size = size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.wfile.write(b"%x\r\n" % len(self.buffer) + bytes(self.buffer) + b"\r\n")
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ChainedReader:
+    """把按块生成的内容包装成tarfile需要的可读文件对象"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.buffer = b""
+        self.position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self.buffer[self.position:] + b"".join(self.blocks)
+            self.buffer, self.position = b"", 0
+            return data
+        while len(self.buffer) - self.position < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer = self.buffer[self.position:] + block
+            self.position = 0
+        data = self.buffer[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def public(self, material):
+        return {key: value for key, value in material.items() if key != "path"}
+
+    def find_file(self):
+        url = self.path.split("?")[0]
+        for material in MATERIALS:
+            if material["fileUrl"] == unquote(url):
+                return material
+        return None
+
+    def do_HEAD(self):
+        material = self.find_file()
+        if not material:
+            self.send_empty(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(material["fileSize"]))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        url = self.path.split("?")[0]
+        if url == "/api/categories":
+            names = sorted({material["category"] for material in MATERIALS})
+            self.send_json([{"name": name} for name in names])
+            return
+        if url == "/api/materials":
+            self.send_json([self.public(material) for material in MATERIALS])
+            return
+        if url.endswith(".sig"):
+            material = next((m for m in MATERIALS if m["fileUrl"] == unquote(url[:-4])), None)
+            if not material or material["path"] is None:
+                self.send_empty(404)
+                return
+            self.send_json(file_signature(material["path"]))
+            return
+        material = self.find_file()
+        if not material:
+            self.send_empty(404)
+            return
+
+        size = material["fileSize"]
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        for block in read_content(material, start, end - start + 1):
+            self.wfile.write(block)
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/api/materials/bundle" or not BUNDLE_ENABLED:
+            self.send_empty(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        ids = [str(i) for i in json.loads(self.rfile.read(length) or b"{}").get("ids", [])]
+        by_id = {material["id"]: material for material in MATERIALS}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-tar")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # 边读文件边写tar流，成员名为"课件ID/文件名"
+        writer = ChunkedWriter(self.wfile)
+        with tarfile.open(fileobj=writer, mode="w|") as archive:
+            for material_id in ids:
+                material = by_id.get(material_id)
+                if material:
+                    info = tarfile.TarInfo(f"{material_id}/{os.path.basename(material['fileUrl'])}")
+                    info.size = material["fileSize"]
+                    info.mtime = int(datetime.strptime(material["uploadDate"], "%Y-%m-%d").timestamp())
+                    archive.addfile(info, ChainedReader(read_content(material, 0, info.size)))
+        writer.close()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    BUNDLE_ENABLED = "no-bundle" not in options
+    if "synthetic" in options:
+        port = int(args[0]) if args else 8000
+        MATERIALS = synthetic_materials(int(options["synthetic"]), int(options.get("file-size") or 1024 * 1024))
+    elif args:
+        ROOT = args[0]
+        port = int(args[1]) if len(args) > 1 else 8000
+        MATERIALS = scan_materials(ROOT)
+    else:
+        print(__doc__)
+        sys.exit(1)
+    print(f"共{len(MATERIALS)}个课件，监听 http://127.0.0.1:{port}")
+    http.server.ThreadingHTTPServer(("127.0.0.1", port), StubHandler).serve_forever()